@@ -0,0 +1,4 @@
+import time
+
+# Момент начала импорта приложения: от него app.startup считает холодный старт
+IMPORT_STARTED = time.perf_counter()
@@ -0,0 +1,155 @@
+"""Проверка Telegram WebApp initData и сессионные токены.
+
+Клиент один раз передаёт в POST /api/init строку initData из Telegram
+WebApp. Сервер проверяет её подпись (HMAC-SHA256 с ключом от токена бота,
+см. https://core.telegram.org/bots/webapps#validating-data-received-via-the-mini-app)
+и выдаёт подписанный JWT с внутренним id и telegram_id пользователя.
+Дальше клиент шлёт заголовок Authorization: Bearer <токен>, и зависимость
+optional_identity разбирает его без обращения к базе. Недавно проверенные
+токены лежат в небольшом LRU-кэше, так что повторная проверка — это поиск
+в словаре.
+
+Старые параметры current_user_id и telegram_id пока принимаются и без
+токена; AUTH_REQUIRED=1 делает токен обязательным.
+"""
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+from urllib.parse import parse_qsl
+
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from jose import JWTError, jwt
+
+TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
+# Без SESSION_SECRET токены подписываются ключом от токена бота; если нет и
+# его, ключ случайный, и токены не переживают перезапуск и не подходят другим воркерам
+SESSION_SECRET = os.getenv("SESSION_SECRET") or (
+    hashlib.sha256(b"session:" + TELEGRAM_BOT_TOKEN.encode()).hexdigest() if TELEGRAM_BOT_TOKEN
+    else secrets.token_hex(32)
+)
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(7 * 24 * 3600)))
+# initData старше этого возраста не принимается: защита от повтора перехваченной строки
+INIT_DATA_MAX_AGE = int(os.getenv("INIT_DATA_MAX_AGE", str(24 * 3600)))
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+AUTH_REQUIRED = os.getenv("AUTH_REQUIRED", "0") == "1"
+ALGORITHM = "HS256"
+
+
+class Identity(NamedTuple):
+    user_id: int
+    telegram_id: str
+
+
+def unauthorized(detail: str):
+    return HTTPException(status_code=401, detail=detail, headers={"WWW-Authenticate": "Bearer"})
+
+
+def validate_init_data(init_data: str, bot_token: str = TELEGRAM_BOT_TOKEN,
+                       max_age: int = INIT_DATA_MAX_AGE) -> dict:
+    """Проверяет подпись initData и возвращает пользователя Telegram (поле user)."""
+    if not bot_token:
+        raise HTTPException(status_code=503, detail="TELEGRAM_BOT_TOKEN is not configured")
+    fields = dict(parse_qsl(init_data, keep_blank_values=True))
+    received_hash = fields.pop("hash", "")
+    data_check_string = "\n".join(f"{key}={value}" for key, value in sorted(fields.items()))
+    secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    expected_hash = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected_hash, received_hash):
+        raise unauthorized("Invalid initData signature")
+    try:
+        auth_date = int(fields["auth_date"])
+        user = json.loads(fields["user"])
+        user["id"]
+    except (KeyError, ValueError, TypeError):
+        raise unauthorized("Malformed initData")
+    if max_age and time.time() - auth_date > max_age:
+        raise unauthorized("initData is expired")
+    return user
+
+
+def issue_token(user_id: int, telegram_id: str, ttl: int = SESSION_TTL_SECONDS) -> str:
+    now = int(time.time())
+    claims = {"sub": str(user_id), "tg": telegram_id, "iat": now, "exp": now + ttl}
+    return jwt.encode(claims, SESSION_SECRET, algorithm=ALGORITHM)
+
+
+class TokenCache:
+    """LRU-кэш проверенных токенов: токен -> (время истечения, Identity).
+
+    Хранит только токены с верной подписью, поэтому попадание в кэш
+    заменяет проверку HMAC; срок действия сверяется при каждом чтении.
+    """
+
+    def __init__(self, maxsize: int = AUTH_TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[Identity]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, token: str, expires: float, identity: Identity):
+        with self._lock:
+            self._entries[token] = (expires, identity)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+token_cache = TokenCache()
+
+
+def decode_token(token: str) -> Identity:
+    """Identity из токена; подпись и срок проверяются без обращения к базе."""
+    identity = token_cache.get(token)
+    if identity is not None:
+        return identity
+    try:
+        claims = jwt.decode(token, SESSION_SECRET, algorithms=[ALGORITHM])
+        identity = Identity(user_id=int(claims["sub"]), telegram_id=str(claims["tg"]))
+    except (JWTError, KeyError, ValueError):
+        raise unauthorized("Invalid or expired session token")
+    token_cache.put(token, claims["exp"], identity)
+    return identity
+
+
+bearer = HTTPBearer(auto_error=False)
+
+
+def optional_identity(credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer)) -> Optional[Identity]:
+    """Зависимость: Identity из заголовка Authorization или None, если его нет."""
+    if credentials is None:
+        if AUTH_REQUIRED:
+            raise unauthorized("Session token required")
+        return None
+    return decode_token(credentials.credentials)
+
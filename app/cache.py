@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from app import models
+
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "60"))
+
+
+def serialize_user(user: models.User) -> dict:
+    return {column.name: getattr(user, column.name) for column in models.User.__table__.columns}
+
+
+class ProfileCache:
+    """LRU-кэш сериализованных профилей с TTL.
+
+    Профиль доступен и по telegram_id, и по внутреннему id. Кэш живёт внутри
+    процесса, поэтому при нескольких воркерах чужие изменения видны только
+    после истечения TTL.
+    """
+
+    def __init__(self, maxsize: int = PROFILE_CACHE_SIZE, ttl: float = PROFILE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # id -> (время истечения, профиль)
+        self._entries = OrderedDict()
+        self._by_telegram_id = {}
+        self._lock = threading.Lock()
+
+    def _get(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._drop(user_id)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return entry[1]
+
+    def _drop(self, user_id):
+        _, profile = self._entries.pop(user_id)
+        if self._by_telegram_id.get(profile["telegram_id"]) == user_id:
+            del self._by_telegram_id[profile["telegram_id"]]
+
+    def get_by_id(self, user_id: int):
+        with self._lock:
+            return self._get(user_id)
+
+    def get_by_telegram_id(self, telegram_id: str):
+        with self._lock:
+            user_id = self._by_telegram_id.get(telegram_id)
+            if user_id is None:
+                self.misses += 1
+                return None
+            return self._get(user_id)
+
+    def put(self, user: models.User) -> dict:
+        profile = serialize_user(user)
+        with self._lock:
+            if profile["id"] in self._entries:
+                self._drop(profile["id"])
+            self._entries[profile["id"]] = (time.monotonic() + self.ttl, profile)
+            self._by_telegram_id[profile["telegram_id"]] = profile["id"]
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+        return profile
+
+    def invalidate(self, user_id: int = None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+                self._by_telegram_id.clear()
+            elif user_id in self._entries:
+                self._drop(user_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+profile_cache = ProfileCache()
@@ -1,6 +1,25 @@
-from sqlalchemy.orm import Session
-from app import models, schemas
-from sqlalchemy import func
+import random
+from sqlalchemy.orm import Session, load_only
+from app import models, schemas, search, sharding
+from app.cache import profile_cache
+from app.notifications import record_match
+from app.ranking import ranker
+from app.seen import seen_index
+from app.sharding import session_for
+from sqlalchemy import and_, column, exists, func, literal_column, or_, select, table, tuple_, union_all
+
+# Сколько случайных id проверяем за один запрос и сколько раундов делаем,
+# прежде чем перейти к последовательному обходу таблицы
+NEXT_PROFILE_SAMPLE_SIZE = 16
+NEXT_PROFILE_SAMPLE_ROUNDS = 3
+NEXT_PROFILE_SCAN_BATCH = 500
+
+# Колонки users для списка совпадений
+MATCH_LIST_FIELDS = ("id", "name", "age", "photo_url", "car", "region")
+# Колонки users для результатов поиска
+SEARCH_RESULT_FIELDS = ("id", "name", "age", "photo_url", "car", "region", "about")
+# Сколько найденных анкет ранжируем по релевантности за один запрос поиска
+SEARCH_CANDIDATES = 10000
 
 def get_user_by_telegram_id(db: Session, telegram_id: str):
     return db.query(models.User).filter(models.User.telegram_id == telegram_id).first()
@@ -10,8 +29,19 @@ def create_user(db: Session, user: schemas.UserCreate):
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    profile_cache.put(db_user)
+    ranker.upsert_user(db_user)
     return db_user
 
+def get_profile_by_telegram_id(db: Session, telegram_id: str):
+    # Сериализованный профиль из кэша; в базу идём только при промахе
+    profile = profile_cache.get_by_telegram_id(telegram_id)
+    if profile is None:
+        user = get_user_by_telegram_id(db, telegram_id)
+        if user:
+            profile = profile_cache.put(user)
+    return profile
+
 def update_user(db: Session, telegram_id: str, user: schemas.UserUpdate):
     db_user = get_user_by_telegram_id(db, telegram_id)
     if db_user:
@@ -19,58 +49,422 @@ def update_user(db: Session, telegram_id: str, user: schemas.UserUpdate):
             setattr(db_user, key, value)
         db.commit()
         db.refresh(db_user)
+        profile_cache.put(db_user)
+        ranker.upsert_user(db_user)
     return db_user
 
+def insert_ignore(db: Session, model, *index_elements):
+    """INSERT ... ON CONFLICT DO NOTHING по уникальному индексу index_elements."""
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    return dialect_insert(model).on_conflict_do_nothing(index_elements=list(index_elements))
+
+def insert_swipe(db: Session, model):
+    """INSERT ... ON CONFLICT DO NOTHING для таблицы свайпов.
+
+    Повторный свайп той же пары стоит одной проверки по уникальному индексу
+    (from_user_id, to_user_id) и не создаёт дубликатов.
+    """
+    return insert_ignore(db, model, "from_user_id", "to_user_id")
+
+def canonical_pair(user_a: int, user_b: int):
+    # Матч хранится как (меньший id, больший id), чтобы каждую сторону искать по своему индексу
+    return (user_a, user_b) if user_a < user_b else (user_b, user_a)
+
 def like_user(db: Session, from_user_id: int, to_user_id: int):
-    like = models.Like(from_user_id=from_user_id, to_user_id=to_user_id)
-    db.add(like)
-    db.commit()
-    db.refresh(like)
-    
-    # После добавления лайка проверяем на матч
+    # Встречный лайк пары проверяется под блокировкой шардов обоих участников
+    sharding.lock_shards(db, [from_user_id, to_user_id])
+    swipes = session_for(db, from_user_id)
+    [values] = sharding.with_ids(models.Like.__table__, [{"from_user_id": from_user_id, "to_user_id": to_user_id}])
+    like = swipes.scalar(insert_swipe(swipes, models.Like).values(**values).returning(models.Like))
+    if like is None:
+        # Повторный запрос: лайк уже записан, возвращаем прежний результат.
+        # Если матча нет, проверяем взаимность заново: встречный лайк мог
+        # появиться, а матч не записаться (коммит шардов не атомарен)
+        like = swipes.query(models.Like).filter(
+            models.Like.from_user_id == from_user_id,
+            models.Like.to_user_id == to_user_id
+        ).first()
+        match = get_match(db, from_user_id, to_user_id) or create_match(db, from_user_id, to_user_id)
+        if match is None:
+            db.rollback()
+        return like, match
+
+    # После добавления лайка проверяем на матч (лайк и матч коммитятся вместе)
     match = create_match(db, from_user_id, to_user_id)
+    if match is None:
+        db.commit()
+    seen_index.add(from_user_id, to_user_id)
+    ranker.record_swipe(from_user_id)
     return like, match
 
 def dislike_user(db: Session, from_user_id: int, to_user_id: int):
-    dislike = models.Dislike(from_user_id=from_user_id, to_user_id=to_user_id)
-    db.add(dislike)
+    swipes = session_for(db, from_user_id)
+    [values] = sharding.with_ids(models.Dislike.__table__, [{"from_user_id": from_user_id, "to_user_id": to_user_id}])
+    swipes.execute(insert_swipe(swipes, models.Dislike).values(**values))
     db.commit()
+    seen_index.add(from_user_id, to_user_id)
+    ranker.record_swipe(from_user_id)
+
+def get_match(db: Session, user_a: int, user_b: int):
+    user1_id, user2_id = canonical_pair(user_a, user_b)
+    return session_for(db, user1_id).query(models.Match).filter(
+        models.Match.user1_id == user1_id,
+        models.Match.user2_id == user2_id
+    ).first()
+
+def insert_matches(db: Session, pairs):
+    """Вставляет матчи (канонические пары), пропуская существующие; без коммита.
+
+    Возвращает (id, user1_id, user2_id) новых матчей. С шардами матч пишется
+    в шард user1_id, а копия с тем же id — в шард user2_id (см. app.sharding).
+    """
+    created = []
+    for matches, group in sharding.group_by_shard(db, pairs, key=lambda pair: pair[0]).items():
+        created += matches.execute(
+            insert_ignore(matches, models.Match, "user1_id", "user2_id")
+            .returning(models.Match.id, models.Match.user1_id, models.Match.user2_id),
+            sharding.with_ids(models.Match.__table__, [
+                {"user1_id": user1_id, "user2_id": user2_id} for user1_id, user2_id in group
+            ])
+        ).all()
+    if sharding.enabled():
+        match_ids = {(user1_id, user2_id): match_id for match_id, user1_id, user2_id in created}
+        for copies, group in sharding.group_by_shard(db, pairs, key=lambda pair: pair[1]).items():
+            group = [pair for pair in group if session_for(db, pair[0]) is not copies]
+            if group:
+                copies.execute(
+                    insert_ignore(copies, models.Match, "user1_id", "user2_id"),
+                    [{"id": match_ids.get(pair) or get_match(db, *pair).id, "user1_id": pair[0], "user2_id": pair[1]}
+                     for pair in group]
+                )
+    for match_id, user1_id, user2_id in created:
+        record_match(db, match_id, user1_id, user2_id)
+    return created
+
+def reciprocal_likes(db: Session, from_user_id: int, to_user_ids) -> set:
+    """Кто из to_user_ids уже лайкнул from_user_id; их лайки лежат в их шардах, один запрос на шард.
+
+    Лайки, перенесённые очисткой в likes_archive, тоже считаются: архив не
+    должен мешать матчу. Обе таблицы читаются одним запросом, поэтому
+    параллельный перенос лайка в архив не спрячет его от проверки.
+    """
+    found = set()
+    for likes, group in sharding.group_by_shard(db, to_user_ids).items():
+        found.update(likes.scalars(union_all(*(
+            select(model.from_user_id).where(model.from_user_id.in_(group), model.to_user_id == from_user_id)
+            for model in (models.Like, models.LikeArchive)
+        ))))
+    return found
 
 def create_match(db: Session, from_user_id: int, to_user_id: int):
     # Если второй пользователь лайкнул первого, создаём матч
-    reverse_like = db.query(models.Like).filter(
-        models.Like.from_user_id == to_user_id,
-        models.Like.to_user_id == from_user_id
-    ).first()
-    if reverse_like:
-        match = models.Match(user1_id=from_user_id, user2_id=to_user_id)
-        db.add(match)
+    if reciprocal_likes(db, from_user_id, [to_user_id]):
+        insert_matches(db, [canonical_pair(from_user_id, to_user_id)])
         db.commit()
-        db.refresh(match)
-        return match
+        # Матч мог появиться параллельно из встречного лайка
+        return get_match(db, from_user_id, to_user_id)
     return None
 
+def apply_swipes(db: Session, from_user_id: int, swipes):
+    """Записывает пачку лайков и дизлайков одной транзакцией.
+
+    Повторно присланные свайпы не дублируются: для них возвращаются id
+    уже существующих лайков и матчей.
+
+    Возвращает список словарей {"to_user_id", "like", "match"} в порядке swipes.
+    """
+    results = write_swipes(db, from_user_id, swipes)
+    db.commit()
+    remember_swipes(from_user_id, swipes)
+    return results
+
+def apply_swipe_groups(db: Session, jobs):
+    """Записывает свайпы нескольких запросов одним коммитом (group commit).
+
+    jobs — список пар (from_user_id, swipes); возвращает результаты
+    write_swipes для каждой пары в том же порядке.
+    """
+    # Шарды всех участников группы блокируем сразу, чтобы сохранить порядок захвата
+    sharding.lock_shards(db, {user_id for from_user_id, swipes in jobs for user_id in swipe_users(from_user_id, swipes)})
+    results = [write_swipes(db, from_user_id, swipes) for from_user_id, swipes in jobs]
+    db.commit()
+    for from_user_id, swipes in jobs:
+        remember_swipes(from_user_id, swipes)
+    return results
+
+def remember_swipes(from_user_id: int, swipes):
+    for s in swipes:
+        seen_index.add(from_user_id, s.to_user_id)
+        ranker.record_swipe(from_user_id)
+
+def swipe_users(from_user_id: int, swipes):
+    # Чьи шарды затрагивает пачка: автора и тех, кого он лайкнул (там ищется встречный лайк)
+    return [from_user_id, *(s.to_user_id for s in swipes if s.action == "like")]
+
+def write_swipes(db: Session, from_user_id: int, swipes):
+    # Запись пачки свайпов без коммита; транзакцией управляет вызывающий код
+    liked = list(dict.fromkeys(s.to_user_id for s in swipes if s.action == "like"))
+    disliked = list(dict.fromkeys(s.to_user_id for s in swipes if s.action == "dislike"))
+    sharding.lock_shards(db, swipe_users(from_user_id, swipes))
+
+    swipes_db = session_for(db, from_user_id)
+    like_ids = {}
+    if liked:
+        rows = swipes_db.execute(
+            insert_swipe(swipes_db, models.Like).returning(models.Like.id, models.Like.to_user_id),
+            sharding.with_ids(models.Like.__table__, [
+                {"from_user_id": from_user_id, "to_user_id": to_user_id} for to_user_id in liked
+            ])
+        )
+        like_ids = {to_user_id: like_id for like_id, to_user_id in rows}
+    if disliked:
+        swipes_db.execute(
+            insert_swipe(swipes_db, models.Dislike),
+            sharding.with_ids(models.Dislike.__table__, [
+                {"from_user_id": from_user_id, "to_user_id": to_user_id} for to_user_id in disliked
+            ])
+        )
+
+    match_ids = {}
+    repeated = [to_user_id for to_user_id in liked if to_user_id not in like_ids]
+    if repeated:
+        # Лайки, записанные предыдущими запросами: подтягиваем их id и матчи
+        like_ids.update((to_user_id, like_id) for like_id, to_user_id in swipes_db.query(
+            models.Like.id, models.Like.to_user_id
+        ).filter(
+            models.Like.from_user_id == from_user_id,
+            models.Like.to_user_id.in_(repeated)
+        ))
+        # id матча берём из шарда меньшего id пары, как его отдаёт get_match
+        for matches, group in sharding.group_by_shard(db, repeated, key=lambda to_user_id: min(from_user_id, to_user_id)).items():
+            match_ids.update(
+                (user2_id if user1_id == from_user_id else user1_id, match_id)
+                for match_id, user1_id, user2_id in matches.query(
+                    models.Match.id, models.Match.user1_id, models.Match.user2_id
+                ).filter(
+                    ((models.Match.user1_id == from_user_id) & models.Match.user2_id.in_(
+                        [to_user_id for to_user_id in group if to_user_id > from_user_id])) |
+                    ((models.Match.user2_id == from_user_id) & models.Match.user1_id.in_(
+                        [to_user_id for to_user_id in group if to_user_id < from_user_id]))
+                )
+            )
+
+    # Взаимные лайки ищем для новых лайков пачки и для повторных, у которых
+    # нет матча: повтор запроса дописывает матч, если прошлый раз он не записался
+    unmatched = [to_user_id for to_user_id in liked if to_user_id not in match_ids]
+    reciprocal = reciprocal_likes(db, from_user_id, unmatched)
+    if reciprocal:
+        pairs = [canonical_pair(from_user_id, to_user_id) for to_user_id in reciprocal]
+        for match_id, user1_id, user2_id in insert_matches(db, pairs):
+            match_ids[user2_id if user1_id == from_user_id else user1_id] = match_id
+    return [
+        {
+            "to_user_id": s.to_user_id,
+            "like": like_ids.get(s.to_user_id) if s.action == "like" else None,
+            "match": match_ids.get(s.to_user_id) if s.action == "like" else None
+        }
+        for s in swipes
+    ]
+
 def get_all_skipped_ids(db: Session, user_id: int):
+    db = session_for(db, user_id)
     liked = db.query(models.Like.to_user_id).filter(models.Like.from_user_id == user_id)
     disliked = db.query(models.Dislike.to_user_id).filter(models.Dislike.from_user_id == user_id)
+    archived = db.query(models.LikeArchive.to_user_id).filter(models.LikeArchive.from_user_id == user_id)
     liked_ids = [id_tuple[0] for id_tuple in liked.all()]
     disliked_ids = [id_tuple[0] for id_tuple in disliked.all()]
-    return liked_ids + disliked_ids
+    archived_ids = [id_tuple[0] for id_tuple in archived.all()]
+    return liked_ids + disliked_ids + archived_ids
 
-def get_next_profile(db: Session, current_user_id: int):
-    skipped_ids = get_all_skipped_ids(db, current_user_id)
-    return db.query(models.User).filter(
-        models.User.id != current_user_id,
-        ~models.User.id.in_(skipped_ids)
-    ).order_by(func.random()).first()
+def profile_filters(region: str = None, min_age: int = None, max_age: int = None, car: str = None,
+                    dialect: str = "sqlite"):
+    """Условия фильтра анкет.
+
+    Сами по себе условия не выбирают индекс: обход по индексу задаёт порядок
+    из profile_scan_key, а эти условия ограничивают диапазон в нём.
+    """
+    conditions = []
+    if region is not None:
+        conditions.append(models.User.region == region)
+    if min_age is not None:
+        conditions.append(models.User.age >= min_age)
+    if max_age is not None:
+        conditions.append(models.User.age <= max_age)
+    if car and dialect == "sqlite":
+        # Поиск по началу названия как диапазон в NOCASE, чтобы работал индекс ix_users_car_nocase
+        conditions.append(models.User.car.collate("NOCASE") >= car)
+        conditions.append(models.User.car.collate("NOCASE") < car + "\U0010ffff")
+    elif car:
+        conditions.append(func.lower(models.User.car).startswith(car.lower(), autoescape=True))
+    return conditions
+
+def profile_scan_key(min_age: int = None, max_age: int = None, car: str = None, dialect: str = "sqlite"):
+    """Колонка обхода анкет с фильтрами и случайное начало в ней.
+
+    Вторичный индекс SQLite неявно заканчивается rowid, поэтому (region, age),
+    (age) и (car COLLATE NOCASE) уже упорядочены по (колонка, id): обход
+    ORDER BY колонка, id с условием (колонка, id) > последней пары читает
+    только подходящие записи индекса, без перебора всех id.
+    """
+    if car and dialect == "sqlite":
+        return models.User.car.collate("NOCASE"), car
+    if car:
+        return func.lower(models.User.car), car.lower()
+    lowest = min_age if min_age is not None else 0
+    return models.User.age, random.randint(lowest, max(lowest, max_age if max_age is not None else schemas.MAX_AGE))
 
-def get_matches(db: Session, user_id: int):
-    return db.query(models.User).join(
-        models.Match,
-        (models.User.id == models.Match.user1_id) | (models.User.id == models.Match.user2_id)
-    ).filter(
-        (models.Match.user1_id == user_id) | (models.Match.user2_id == user_id)
-    ).all()
+def get_next_profile(db: Session, current_user_id: int, region: str = None,
+                     min_age: int = None, max_age: int = None, car: str = None, fields=None):
+    # fields — имена колонок, которые нужно загрузить (None — все)
+    options = [load_only(*(getattr(models.User, name) for name in fields))] if fields else []
+
+    # Ранжированная выдача; фильтр по началу названия машины идёт через индекс ниже
+    if ranker.enabled and not car:
+        user_id = ranker.next_candidate(db, current_user_id, region, min_age, max_age)
+        if user_id is not None:
+            user = db.get(models.User, user_id, options=options)
+            if user is not None:
+                return user
+
+    seen = seen_index.get(db, current_user_id)
+    max_id = db.query(func.max(models.User.id)).scalar()
+    if not max_id:
+        return None
+    dialect = db.get_bind().dialect.name
+    filters = profile_filters(region, min_age, max_age, car, dialect)
+
+    def is_candidate(user_id):
+        return user_id != current_user_id and not seen_index.contains(db, current_user_id, user_id)
+
+    # Случайная выборка с отбраковкой: берём несколько случайных id и проверяем их
+    # по индексу просмотренных, поэтому время не растёт с количеством свайпов.
+    # С фильтрами случайные id почти всегда мимо, поэтому сразу идём по индексу
+    for _ in range(0 if filters else NEXT_PROFILE_SAMPLE_ROUNDS):
+        sample = [i for i in {random.randint(1, max_id) for _ in range(NEXT_PROFILE_SAMPLE_SIZE)} if is_candidate(i)]
+        if not sample:
+            continue
+        users = db.query(models.User).options(*options).filter(models.User.id.in_(sample)).all()
+        if users:
+            return random.choice(users)
+
+    # Почти все профили просмотрены (или в id много дыр, или заданы фильтры): обходим
+    # подходящие анкеты пачками по ключу (колонка фильтра, id) или по id, начиная
+    # со случайной точки, и заворачиваем в начало
+    if len(seen) >= max_id - 1:
+        return None
+    if filters:
+        scan_column, start_value = profile_scan_key(min_age, max_age, car, dialect)
+        keys = (scan_column, models.User.id)
+        start = (start_value, random.randint(1, max_id))
+    else:
+        keys = (models.User.id,)
+        start = (random.randint(1, max_id),)
+    key = tuple_(*keys)
+    for bound in (key >= tuple_(*start), key < tuple_(*start)):
+        after = None
+        while True:
+            query = select(*keys).where(bound, *filters)
+            if after is not None:
+                query = query.where(key > tuple_(*after))
+            rows = db.execute(query.order_by(*keys).limit(NEXT_PROFILE_SCAN_BATCH)).all()
+            if not rows:
+                break
+            for row in rows:
+                if is_candidate(row[-1]):
+                    return db.get(models.User, row[-1], options=options)
+            after = tuple(rows[-1])
+    return None
+
+def get_matches(db: Session, user_id: int, limit: int = 50, after: int = 0, fields=MATCH_LIST_FIELDS):
+    """Страница совпадений пользователя, упорядоченная по id партнёра.
+
+    Keyset-пагинация: after — id последнего партнёра с предыдущей страницы.
+    Каждая сторона пары читается по своему индексу, из users берутся только
+    колонки fields (по умолчанию — нужные для списка).
+    """
+    as_user1 = select(models.Match.user2_id.label("partner_id")).where(
+        models.Match.user1_id == user_id,
+        models.Match.user2_id > after
+    ).order_by(models.Match.user2_id).limit(limit).subquery()
+    as_user2 = select(models.Match.user1_id.label("partner_id")).where(
+        models.Match.user2_id == user_id,
+        models.Match.user1_id > after
+    ).order_by(models.Match.user1_id).limit(limit).subquery()
+    partners = union_all(select(as_user1.c.partner_id), select(as_user2.c.partner_id)).subquery()
+    columns = [getattr(models.User, name) for name in fields]
+    matches = session_for(db, user_id)
+    if matches is db:
+        return db.execute(
+            select(*columns).join(partners, models.User.id == partners.c.partner_id).order_by(models.User.id).limit(limit)
+        ).all()
+    # Матчи в шарде пользователя, анкеты — в основной базе: два запроса вместо join
+    partner_ids = matches.execute(
+        select(partners.c.partner_id).order_by(partners.c.partner_id).limit(limit)
+    ).scalars().all()
+    if not partner_ids:
+        return []
+    return db.execute(select(*columns).where(models.User.id.in_(partner_ids)).order_by(models.User.id)).all()
+
+def search_profiles(db: Session, current_user_id: int, query: str, limit: int = 20, offset: int = 0,
+                    fields=SEARCH_RESULT_FIELDS):
+    """Анкеты, подходящие под текстовый запрос, лучшие первыми (см. app.search).
+
+    Себя и уже свайпнутых пользователей, в том числе из likes_archive, не
+    возвращает: проверка идёт по индексам (from_user_id, to_user_id) для
+    каждой найденной анкеты.
+    """
+    if not search.words(query):
+        return []
+    not_swiped = (
+        models.User.id != current_user_id,
+        ~exists().where(models.Like.from_user_id == current_user_id, models.Like.to_user_id == models.User.id),
+        ~exists().where(models.Dislike.from_user_id == current_user_id, models.Dislike.to_user_id == models.User.id),
+        ~exists().where(models.LikeArchive.from_user_id == current_user_id,
+                        models.LikeArchive.to_user_id == models.User.id),
+    )
+    statement = select(*(getattr(models.User, name) for name in fields))
+    if sharding.enabled():
+        # Свайпы лежат в шардах, и NOT EXISTS до них не дотянется: просмотренные
+        # анкеты отсеиваем по индексу seen ниже
+        not_swiped = (models.User.id != current_user_id,)
+    if search.available(db.connection()):
+        fts = table(search.FTS_TABLE, column("rowid"), column("rank"))
+        # bm25 считается для каждого совпадения, поэтому по частому слову
+        # ранжируем только SEARCH_CANDIDATES самых новых анкет
+        candidates = select(fts.c.rowid, fts.c.rank).where(
+            literal_column(search.FTS_TABLE).op("MATCH")(search.match_query(query))
+        ).order_by(fts.c.rowid.desc()).limit(SEARCH_CANDIDATES).subquery()
+        statement = statement.join(candidates, candidates.c.rowid == models.User.id).where(
+            *not_swiped
+        ).order_by(candidates.c.rank, models.User.id)
+    else:
+        # Без FTS5: каждое слово должно встретиться в имени, машине или тексте «о себе»
+        matches_words = and_(*(
+            or_(models.User.name.ilike(f"%{word}%"), models.User.car.ilike(f"%{word}%"),
+                models.User.about.ilike(f"%{word}%"))
+            for word in search.words(query)
+        ))
+        statement = statement.where(matches_words, *not_swiped).order_by(models.User.id)
+    if not sharding.enabled():
+        return db.execute(statement.limit(limit).offset(offset)).all()
+    profiles, skipped = [], 0
+    result = db.execute(statement.execution_options(yield_per=NEXT_PROFILE_SCAN_BATCH))
+    try:
+        for row in result:
+            if seen_index.contains(db, current_user_id, row.id):
+                continue
+            if skipped < offset:
+                skipped += 1
+                continue
+            profiles.append(row)
+            if len(profiles) == limit:
+                break
+    finally:
+        result.close()
+    return profiles
 
 def update_about(db: Session, user_id: int, about_text: str):
     user = db.query(models.User).filter(models.User.id == user_id).first()
@@ -78,4 +472,6 @@ def update_about(db: Session, user_id: int, about_text: str):
         user.about = about_text
         db.commit()
         db.refresh(user)
+        profile_cache.put(user)
+        ranker.upsert_user(user)
     return user
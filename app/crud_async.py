@@ -0,0 +1,64 @@
+"""Асинхронные версии функций из app.crud.
+
+Логика запросов живёт в одном месте (app.crud): с AsyncSession функция
+выполняется через run_sync, поэтому ввод-вывод идёт через асинхронный
+драйвер и не занимает пул потоков. С обычной Session (DB_ASYNC=0) функция
+уходит в пул потоков Starlette, как раньше делали синхронные маршруты.
+"""
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from app import crud
+from app.cache import profile_cache
+
+
+async def run(db, fn, *args, **kwargs):
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
+
+async def get_user_by_telegram_id(db, telegram_id: str):
+    return await run(db, crud.get_user_by_telegram_id, telegram_id)
+
+async def get_profile_by_telegram_id(db, telegram_id: str):
+    # Попадание в кэш обслуживается без обращения к сессии и пулу потоков
+    profile = profile_cache.get_by_telegram_id(telegram_id)
+    if profile is None:
+        user = await get_user_by_telegram_id(db, telegram_id)
+        if user:
+            profile = profile_cache.put(user)
+    return profile
+
+async def create_user(db, user):
+    return await run(db, crud.create_user, user)
+
+async def update_user(db, telegram_id: str, user):
+    return await run(db, crud.update_user, telegram_id, user)
+
+async def like_user(db, from_user_id: int, to_user_id: int):
+    return await run(db, crud.like_user, from_user_id, to_user_id)
+
+async def dislike_user(db, from_user_id: int, to_user_id: int):
+    return await run(db, crud.dislike_user, from_user_id, to_user_id)
+
+async def create_match(db, from_user_id: int, to_user_id: int):
+    return await run(db, crud.create_match, from_user_id, to_user_id)
+
+async def apply_swipes(db, from_user_id: int, swipes):
+    return await run(db, crud.apply_swipes, from_user_id, swipes)
+
+async def get_all_skipped_ids(db, user_id: int):
+    return await run(db, crud.get_all_skipped_ids, user_id)
+
+async def get_next_profile(db, current_user_id: int, region: str = None,
+                           min_age: int = None, max_age: int = None, car: str = None, fields=None):
+    return await run(db, crud.get_next_profile, current_user_id, region, min_age, max_age, car, fields)
+
+async def get_matches(db, user_id: int, limit: int = 50, after: int = 0, fields=crud.MATCH_LIST_FIELDS):
+    return await run(db, crud.get_matches, user_id, limit, after, fields)
+
+async def search_profiles(db, current_user_id: int, query: str, limit: int = 20, offset: int = 0,
+                          fields=crud.SEARCH_RESULT_FIELDS):
+    return await run(db, crud.search_profiles, current_user_id, query, limit, offset, fields)
+
+async def update_about(db, user_id: int, about_text: str):
+    return await run(db, crud.update_about, user_id, about_text)
@@ -1,12 +1,132 @@
-from sqlalchemy import create_engine
+import os
+import threading
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"  # Используем SQLite для простоты
+# Основная база (запись) и необязательная реплика для чтения; по умолчанию
+# локальный SQLite-файл, как раньше
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./test.db")
+REPLICA_DATABASE_URL = os.getenv("REPLICA_DATABASE_URL") or None
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+# Настройки пула соединений
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "0") == "1"
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "-1"))
+
+# Сколько секунд после записи пользователь читает с основной базы, а не с реплики
+DB_STICKY_SECONDS = float(os.getenv("DB_STICKY_SECONDS", "5"))
+
+# Шарды свайпов: URL через запятую (см. app/sharding.py); пусто — всё в основной базе
+SWIPE_SHARD_URLS = [url.strip() for url in os.getenv("SWIPE_SHARDS", "").split(",") if url.strip()]
+
+# Асинхронный путь к базе включён по умолчанию; DB_ASYNC=0 возвращает
+# синхронные сессии в пуле потоков (например, чтобы сравнить их в бенчмарке).
+# С шардами работаем синхронно: сессии шардов открываются внутри crud и
+# в асинхронном режиме блокировали бы цикл событий
+ASYNC_DB = os.getenv("DB_ASYNC", "1") != "0" and not SWIPE_SHARD_URLS
+
+# Асинхронные драйверы для синхронных URL
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+def make_async_url(url: str) -> str:
+    scheme, rest = url.split("://", 1)
+    return f"{ASYNC_DRIVERS.get(scheme.split('+')[0], scheme)}://{rest}"
+
+# Настройки SQLite для конкурентной записи: WAL позволяет читать во время записи,
+# synchronous=NORMAL убирает fsync на каждый коммит (в WAL это безопасно),
+# busy_timeout заставляет ждать блокировку вместо "database is locked"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+def configure_sqlite(engine):
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.close()
+
+def engine_options(url: str) -> dict:
+    options = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+    if url.startswith("sqlite"):
+        # Для SQLite оставляем пулы SQLAlchemy по умолчанию: соединение с файлом
+        # дешёвое, а пул aiosqlite привязал бы соединения к одному циклу событий
+        options["connect_args"] = {"check_same_thread": False}
+    else:
+        options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+    return options
+
+def make_engine(url: str):
+    engine = create_engine(url, **engine_options(url))
+    configure_sqlite(engine)
+    return engine
+
+def make_async_engine(url: str):
+    url = make_async_url(url)
+    engine = create_async_engine(url, **engine_options(url))
+    configure_sqlite(engine.sync_engine)
+    return engine
+
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
 
+async_engine = make_async_engine(SQLALCHEMY_DATABASE_URL)
+# expire_on_commit=False: после коммита объекты читаются без ленивой подгрузки,
+# которая в асинхронной сессии недоступна
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# Чтение: реплика, если она задана, иначе та же основная база
+if REPLICA_DATABASE_URL:
+    read_engine = make_engine(REPLICA_DATABASE_URL)
+    async_read_engine = make_async_engine(REPLICA_DATABASE_URL)
+else:
+    read_engine, async_read_engine = engine, async_engine
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+AsyncReadSessionLocal = async_sessionmaker(async_read_engine, autoflush=False, expire_on_commit=False)
+
+
+class StickyWrites:
+    """Помнит, кто недавно писал, чтобы его чтения шли на основную базу
+    (read-your-writes), пока реплика не догнала. Ключи — ("id", user_id) или
+    ("tg", telegram_id). Состояние живёт внутри процесса."""
+
+    def __init__(self, seconds: float = DB_STICKY_SECONDS):
+        self.seconds = seconds
+        self._until = {}
+        self._lock = threading.Lock()
+
+    def mark(self, keys):
+        until = time.monotonic() + self.seconds
+        with self._lock:
+            for key in keys:
+                self._until[key] = until
+            # Заодно выбрасываем истёкшие ключи, чтобы словарь не рос
+            if len(self._until) > 10000:
+                now = time.monotonic()
+                self._until = {k: v for k, v in self._until.items() if v > now}
+
+    def is_sticky(self, keys) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            return any(self._until.get(key, 0) > now for key in keys)
+
+
+sticky_writes = StickyWrites()
+
+
+@event.listens_for(Session, "after_commit")
+def remember_commit(session):
+    # По этому флагу зависимость get_db понимает, что запрос что-то записал
+    session.info["committed"] = True
+
+Base = declarative_base()
@@ -1,129 +1,318 @@
-from fastapi import FastAPI, Depends, HTTPException
-from sqlalchemy.orm import Session
-from app import models, crud, database, utils, schemas
-from app.database import SessionLocal, engine
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, Depends, HTTPException, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import auth, crud_async, database, metrics, retention, sharding, startup, utils, schemas
+from app.cache import serialize_user
+from app.responses import FastJSONResponse, etag_response, parse_fields, project
+from app.database import AsyncReadSessionLocal, AsyncSessionLocal, ReadSessionLocal, SessionLocal, async_engine, engine, sticky_writes
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from app.schemas import AboutUpdate
+from app.writer import SWIPE_GROUP_COMMIT, swipe_writer
+from app.notifications import match_hub
 from fastapi.openapi.utils import get_openapi
 
-# Создание таблиц в базе данных (если их ещё нет)
-models.Base.metadata.create_all(bind=engine)
+# Схема проверяется и создаётся при старте воркера, а не при импорте (см. app.startup)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup.start()
+    compaction = retention.schedule()
+    yield
+    if compaction is not None:
+        compaction.cancel()
+    # Дописываем накопленные свайпы перед остановкой
+    await swipe_writer.stop()
 
 app = FastAPI(
     title="Telegram WebApp for Auto Enthusiasts",
     description="API для приложения знакомств автолюбителей",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse,
+    lifespan=lifespan
 )
 
+# Поля, доступные в параметре fields=
+USER_FIELDS = ("id", "telegram_id", *schemas.UserBase.model_fields)
+PROFILE_FIELDS = tuple(schemas.ProfileRead.model_fields)
+MATCH_FIELDS = tuple(schemas.MatchUser.model_fields)
+FIELDS_DESCRIPTION = "Список полей через запятую; id возвращается всегда"
+
 # Middleware для CORS
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["https://Kileniass.github.io"],  # Разрешаем запросы только с нашего домена
     allow_credentials=False,  # Отключаем credentials для CORS
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["Content-Type", "Accept", "Origin"],
+    allow_headers=["Content-Type", "Accept", "Origin", "Authorization"],
 )
 
-# Зависимость для получения сессии базы данных
-def get_db():
-    db = SessionLocal()
+# Метрики запросов и SQL; добавляется последним, чтобы учитывать и время CORS
+app.add_middleware(metrics.MetricsMiddleware, routes=app.router.routes)
+metrics.instrument_engine(engine)
+metrics.instrument_engine(async_engine.sync_engine)
+if database.REPLICA_DATABASE_URL:
+    metrics.instrument_engine(database.read_engine)
+    metrics.instrument_engine(database.async_read_engine.sync_engine)
+for shard_engine in sharding.router.engines:
+    metrics.instrument_engine(shard_engine)
+
+def sticky_keys(request: Request):
+    # Пользователи, к которым относится запрос: по ним работает read-your-writes
+    keys = []
+    if "telegram_id" in request.path_params:
+        keys.append(("tg", request.path_params["telegram_id"]))
+    # Пользователь из сессионного токена (см. acting_user_id и init_session)
+    for value in (request.path_params.get("user_id"), request.query_params.get("current_user_id"),
+                  getattr(request.state, "user_id", None)):
+        if value is not None and str(value).isdigit():
+            keys.append(("id", int(value)))
+    return keys
+
+@asynccontextmanager
+async def session_scope(async_factory, sync_factory):
+    # AsyncSession или, при DB_ASYNC=0, обычная Session, которую crud_async гоняет в пуле потоков
+    if database.ASYNC_DB:
+        async with async_factory() as db:
+            yield db
+        return
+    db = sync_factory()
     try:
         yield db
     finally:
         db.close()
 
+# Зависимость для получения сессии основной базы (запись и чтение после записи)
+async def get_db(request: Request):
+    async with session_scope(AsyncSessionLocal, SessionLocal) as db:
+        yield db
+        if request.method != "GET" or db.info.get("committed"):
+            sticky_writes.mark(sticky_keys(request))
+
+# Сессия для чтения: реплика, если пользователь недавно ничего не писал
+async def get_read_db(request: Request):
+    if sticky_writes.is_sticky(sticky_keys(request)):
+        factories = AsyncSessionLocal, SessionLocal
+    else:
+        factories = AsyncReadSessionLocal, ReadSessionLocal
+    async with session_scope(*factories) as db:
+        yield db
+
+# Кто делает запрос: из сессионного токена, а без него — из старого параметра current_user_id.
+# Объявляйте раньше сессии базы: get_read_db смотрит на request.state.user_id
+async def acting_user_id(request: Request, current_user_id: Optional[int] = None,
+                         identity: Optional[auth.Identity] = Depends(auth.optional_identity)) -> int:
+    if identity is None:
+        if current_user_id is None:
+            raise auth.unauthorized("Session token or current_user_id required")
+        return current_user_id
+    if current_user_id is not None and current_user_id != identity.user_id:
+        raise HTTPException(status_code=403, detail="current_user_id does not match session token")
+    request.state.user_id = identity.user_id
+    return identity.user_id
+
+def check_owner(identity: Optional[auth.Identity], user_id: Optional[int] = None, telegram_id: Optional[str] = None):
+    # С токеном пользователь работает только со своими данными
+    if identity is None:
+        return
+    if (user_id is not None and user_id != identity.user_id) or (telegram_id is not None and telegram_id != identity.telegram_id):
+        raise HTTPException(status_code=403, detail="Forbidden for this session")
+
+async def own_user_id(user_id: int, identity: Optional[auth.Identity] = Depends(auth.optional_identity)) -> int:
+    check_owner(identity, user_id=user_id)
+    return user_id
+
+async def own_telegram_id(telegram_id: str, identity: Optional[auth.Identity] = Depends(auth.optional_identity)) -> str:
+    check_owner(identity, telegram_id=telegram_id)
+    return telegram_id
+
+@app.get("/metrics", include_in_schema=False, response_class=PlainTextResponse)
+def prometheus_metrics():
+    return metrics.render()
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the auto racing community!"}
 
-@app.get("/api/init/{telegram_id}", 
-    summary="Инициализация пользователя",
-    description="Создает нового пользователя или возвращает существующего",
-    response_description="Данные пользователя")
-def init_user(telegram_id: str, db: Session = Depends(get_db)):
-    user = crud.get_user_by_telegram_id(db, telegram_id)
+@app.post("/api/init",
+    summary="Вход через Telegram WebApp",
+    description="Проверяет подпись initData из Telegram WebApp, создает пользователя при первом входе "
+                "и выдает сессионный токен. Передавайте его в заголовке Authorization: Bearer <token>",
+    response_description="Сессионный токен и данные пользователя",
+    response_model=schemas.SessionToken)
+async def init_session(data: schemas.InitData, request: Request, db: AsyncSession = Depends(get_db)):
+    telegram_user = auth.validate_init_data(data.init_data)
+    telegram_id = str(telegram_user["id"])
+    user = await crud_async.get_profile_by_telegram_id(db, telegram_id)
+    if not user:
+        new_user = schemas.UserCreate(telegram_id=telegram_id, name=telegram_user.get("first_name", ""))
+        user = serialize_user(await crud_async.create_user(db, new_user))
+    request.state.user_id = user["id"]
+    return FastJSONResponse({
+        "token": auth.issue_token(user["id"], telegram_id),
+        "expires_in": auth.SESSION_TTL_SECONDS,
+        "user": user
+    })
+
+@app.get("/api/init/{telegram_id}",
+    summary="Инициализация пользователя (без проверки)",
+    description="Создает нового пользователя или возвращает существующего. Telegram ID не проверяется, "
+                "используйте POST /api/init",
+    response_description="Данные пользователя",
+    response_model=schemas.UserRead)
+async def init_user(request: Request, telegram_id: str = Depends(own_telegram_id),
+                    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION), db: AsyncSession = Depends(get_db)):
+    columns = parse_fields(fields, USER_FIELDS)
+    user = await crud_async.get_profile_by_telegram_id(db, telegram_id)
     if not user:
         new_user = schemas.UserCreate(telegram_id=telegram_id)
-        user = crud.create_user(db, new_user)
-    return user
+        user = serialize_user(await crud_async.create_user(db, new_user))
+    return etag_response(request, project(user, columns))
 
 @app.put("/api/users/{telegram_id}",
     summary="Обновление профиля пользователя",
     description="Обновляет данные профиля пользователя",
-    response_description="Обновленные данные пользователя")
-def update_user_profile(telegram_id: str, user_update: schemas.UserUpdate, db: Session = Depends(get_db)):
-    updated_user = crud.update_user(db, telegram_id, user_update)
+    response_description="Обновленные данные пользователя",
+    response_model=schemas.UserRead)
+async def update_user_profile(user_update: schemas.UserUpdate, telegram_id: str = Depends(own_telegram_id),
+                              db: AsyncSession = Depends(get_db)):
+    updated_user = await crud_async.update_user(db, telegram_id, user_update)
     if not updated_user:
         raise HTTPException(status_code=404, detail="User not found")
-    return updated_user
+    return FastJSONResponse(serialize_user(updated_user))
 
 @app.get("/api/users/{telegram_id}",
     summary="Получение профиля пользователя",
-    description="Возвращает данные профиля пользователя",
-    response_description="Данные пользователя")
-def get_user_profile(telegram_id: str, db: Session = Depends(get_db)):
-    user = crud.get_user_by_telegram_id(db, telegram_id)
+    description="Возвращает данные профиля пользователя. Поддерживает ETag/If-None-Match",
+    response_description="Данные пользователя",
+    response_model=schemas.UserRead)
+async def get_user_profile(request: Request, telegram_id: str = Depends(own_telegram_id),
+                           fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+                           db: AsyncSession = Depends(get_read_db)):
+    columns = parse_fields(fields, USER_FIELDS)
+    user = await crud_async.get_profile_by_telegram_id(db, telegram_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return user
+    return etag_response(request, project(user, columns))
 
 @app.post("/api/profiles/{user_id}/like",
     summary="Лайк профиля",
     description="Отправляет лайк пользователю и проверяет на совпадение",
     response_description="Результат лайка и информация о совпадении")
-def like_profile(user_id: int, current_user_id: int, db: Session = Depends(get_db)):
-    like, match = crud.like_user(db, current_user_id, user_id)
+async def like_profile(user_id: int, current_user_id: int = Depends(acting_user_id), db: AsyncSession = Depends(get_db)):
+    if SWIPE_GROUP_COMMIT:
+        [result] = await swipe_writer.submit(current_user_id, [schemas.SwipeAction(to_user_id=user_id, action="like")])
+        return {"like": result["like"], "match": result["match"]}
+    like, match = await crud_async.like_user(db, current_user_id, user_id)
     return {"like": like.id if like else None, "match": match.id if match else None}
 
 @app.post("/api/profiles/{user_id}/dislike",
     summary="Дизлайк профиля",
     description="Отправляет дизлайк пользователю",
     response_description="Подтверждение дизлайка")
-def dislike_profile(user_id: int, current_user_id: int, db: Session = Depends(get_db)):
-    crud.dislike_user(db, current_user_id, user_id)
+async def dislike_profile(user_id: int, current_user_id: int = Depends(acting_user_id), db: AsyncSession = Depends(get_db)):
+    if SWIPE_GROUP_COMMIT:
+        await swipe_writer.submit(current_user_id, [schemas.SwipeAction(to_user_id=user_id, action="dislike")])
+    else:
+        await crud_async.dislike_user(db, current_user_id, user_id)
     return {"message": "Profile disliked"}
 
+@app.post("/api/profiles/swipes",
+    summary="Пакетная отправка свайпов",
+    description="Записывает пачку лайков и дизлайков (не больше 100) одной транзакцией и проверяет совпадения",
+    response_description="Идентификаторы лайков и совпадений по каждому свайпу")
+async def swipe_profiles(batch: schemas.SwipeBatch, current_user_id: int = Depends(acting_user_id), db: AsyncSession = Depends(get_db)):
+    if SWIPE_GROUP_COMMIT:
+        results = await swipe_writer.submit(current_user_id, batch.swipes)
+    else:
+        results = await crud_async.apply_swipes(db, current_user_id, batch.swipes)
+    return {"results": results}
+
 @app.get("/api/profiles/next",
     summary="Получение следующего профиля",
-    description="Возвращает следующий профиль для просмотра",
-    response_description="Данные профиля")
-def next_profile(current_user_id: int, db: Session = Depends(get_db)):
-    profile = crud.get_next_profile(db, current_user_id)
+    description="Возвращает следующий профиль для просмотра. Можно ограничить регион, "
+                "возраст и марку машины (поиск по началу названия)",
+    response_description="Данные профиля",
+    response_model=schemas.NextProfile)
+async def next_profile(current_user_id: int = Depends(acting_user_id), region: Optional[str] = None,
+                       min_age: Optional[int] = Query(None, ge=0), max_age: Optional[int] = Query(None, ge=0),
+                       car: Optional[str] = None,
+                       fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+                       db: AsyncSession = Depends(get_read_db)):
+    columns = parse_fields(fields, PROFILE_FIELDS)
+    profile = await crud_async.get_next_profile(db, current_user_id, region, min_age, max_age, car, columns)
     if profile:
-        return {
-            "profile": {
-                "id": profile.id,
-                "name": profile.name,
-                "age": profile.age,
-                "photo_url": profile.photo_url,
-                "car": profile.car,
-                "region": profile.region,
-                "about": profile.about
-            }
-        }
+        return FastJSONResponse({"profile": project(profile, columns)})
     else:
-        return {"message": "No more profiles"}
+        return FastJSONResponse({"message": "No more profiles"})
+
+# Дальше этого смещения листать поиск нельзя: глубокие страницы дорого ранжировать
+SEARCH_MAX_OFFSET = 1000
+
+@app.get("/api/profiles/search",
+    summary="Поиск анкет",
+    description="Полнотекстовый поиск по имени, машине и тексту о себе. Слова ищутся по началу, "
+                "должны совпасть все. Уже просмотренные анкеты не возвращаются. "
+                "Для следующей страницы передайте next_offset из ответа в параметре offset",
+    response_description="Страница найденных анкет",
+    response_model=schemas.SearchPage)
+async def search_profiles(current_user_id: int = Depends(acting_user_id), q: str = Query(..., min_length=1, max_length=200),
+                          limit: int = Query(20, ge=1, le=50), offset: int = Query(0, ge=0, le=SEARCH_MAX_OFFSET),
+                          fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+                          db: AsyncSession = Depends(get_read_db)):
+    columns = parse_fields(fields, PROFILE_FIELDS)
+    profiles = await crud_async.search_profiles(db, current_user_id, q, limit, offset, columns)
+    return FastJSONResponse({
+        "profiles": [project(profile, columns) for profile in profiles],
+        "next_offset": offset + limit if len(profiles) == limit and offset + limit <= SEARCH_MAX_OFFSET else None
+    })
 
 @app.get("/api/matches/{user_id}",
     summary="Получение совпадений",
-    description="Возвращает список пользователей, с которыми есть совпадение",
-    response_description="Список совпадений")
-def matches(user_id: int, db: Session = Depends(get_db)):
-    matched_users = crud.get_matches(db, user_id)
-    return {
-        "matches": [
-            {
-                "id": user.id,
-                "name": user.name,
-                "age": user.age,
-                "photo_url": user.photo_url,
-                "car": user.car,
-                "region": user.region,
-                "about": user.about
-            }
-            for user in matched_users
-        ]
-    }
+    description="Возвращает страницу пользователей, с которыми есть совпадение. "
+                "Для следующей страницы передайте next_after из ответа в параметре after. "
+                "Поддерживает ETag/If-None-Match",
+    response_description="Список совпадений",
+    response_model=schemas.MatchPage)
+async def matches(request: Request, user_id: int = Depends(own_user_id), limit: int = Query(50, ge=1, le=200), after: int = 0,
+                  fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+                  db: AsyncSession = Depends(get_read_db)):
+    columns = parse_fields(fields, MATCH_FIELDS)
+    matched_users = await crud_async.get_matches(db, user_id, limit, after, columns)
+    return etag_response(request, {
+        "matches": [project(user, columns) for user in matched_users],
+        "next_after": matched_users[-1].id if len(matched_users) == limit else None
+    })
+
+# Интервал пустых комментариев, чтобы прокси не закрывали тихое соединение
+MATCH_STREAM_KEEPALIVE = 15
+
+@app.get("/api/matches/{user_id}/stream",
+    summary="Поток новых совпадений",
+    description="Server-Sent Events: присылает событие match, когда у пользователя появляется совпадение. "
+                "Ожидание событий не обращается к базе данных",
+    response_description="Поток событий text/event-stream")
+async def match_stream(user_id: int, token: Optional[str] = Query(None, description="Сессионный токен: EventSource не умеет "
+                                                                                     "передавать заголовок Authorization")):
+    identity = auth.decode_token(token) if token else None
+    if identity is None and auth.AUTH_REQUIRED:
+        raise auth.unauthorized("Session token required")
+    check_owner(identity, user_id=user_id)
+
+    async def events():
+        async with match_hub.subscribe(user_id) as queue:
+            while True:
+                try:
+                    payload = await asyncio.wait_for(queue.get(), MATCH_STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {payload['type']}\ndata: {json.dumps(payload)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.get("/api/generate-password",
     summary="Генерация пароля",
@@ -137,8 +326,11 @@ def generate_password():
     summary="Обновление описания",
     description="Обновляет раздел 'О себе' в профиле",
     response_description="Обновленное описание")
-def update_about(data: AboutUpdate, db: Session = Depends(get_db)):
-    user = crud.update_about(db, user_id=data.user_id, about_text=data.about)
+async def update_about(data: AboutUpdate, identity: Optional[auth.Identity] = Depends(auth.optional_identity),
+                       db: AsyncSession = Depends(get_db)):
+    check_owner(identity, user_id=data.user_id)
+    user = await crud_async.update_about(db, user_id=data.user_id, about_text=data.about)
+    sticky_writes.mark([("id", data.user_id)])
     if user:
         return {"message": "About section updated", "about": user.about}
     else:
@@ -0,0 +1,242 @@
+"""Метрики запросов в формате Prometheus.
+
+MetricsMiddleware считает гистограмму времени ответа и число запросов
+в работе по шаблону маршрута. Хуки SQLAlchemy (instrument_engine) копят для
+текущего запроса число SQL-выражений, их суммарное время и самое медленное
+выражение. Всё это отдаётся текстом Prometheus через render().
+
+SQL фонового писателя свайпов выполняется вне запросов; share() делит его
+между запросами, которые ждали коммита, поэтому лайки и пакетные свайпы
+видны в метриках своих маршрутов.
+
+METRICS_SLOW_REQUEST_MS > 0 включает журнал медленных запросов: в него
+попадают запросы дольше порога вместе со всеми выполненными SQL-выражениями.
+"""
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from starlette.routing import Match
+
+from app import auth, startup
+from app.cache import profile_cache
+from app.seen import seen_index
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_REQUEST_MS = float(os.getenv("METRICS_SLOW_REQUEST_MS", "0"))
+# Маршрут для SQL вне HTTP-запросов (фоновые задачи)
+BACKGROUND_ROUTE = "background"
+
+logger = logging.getLogger(__name__)
+
+
+class RequestStats:
+    __slots__ = ("statements", "sql_seconds", "slowest", "slowest_seconds", "captured")
+
+    def __init__(self, capture: bool = False):
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.slowest = None
+        self.slowest_seconds = 0.0
+        self.captured = [] if capture else None
+
+
+current_request = ContextVar("current_request", default=None)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (method, route) -> [счётчики по корзинам..., сумма, количество]
+        self.latency = {}
+        self.in_flight = {}
+        # (method, route, status) -> количество
+        self.requests = {}
+        # route -> [выражений, секунд, самое медленное выражение в секундах]
+        self.sql = {}
+
+    def start(self, method, route):
+        with self._lock:
+            self.in_flight[(method, route)] = self.in_flight.get((method, route), 0) + 1
+
+    def finish(self, method, route, status, seconds, stats: RequestStats):
+        with self._lock:
+            self.in_flight[(method, route)] -= 1
+            self.requests[(method, route, status)] = self.requests.get((method, route, status), 0) + 1
+            histogram = self.latency.setdefault((method, route), [0] * len(LATENCY_BUCKETS) + [0.0, 0])
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+            self._add_sql(route, stats)
+
+    def _add_sql(self, route, stats: RequestStats):
+        sql = self.sql.setdefault(route, [0, 0.0, 0.0])
+        sql[0] += stats.statements
+        sql[1] += stats.sql_seconds
+        sql[2] = max(sql[2], stats.slowest_seconds)
+
+    def add_background_sql(self, seconds, statements=1, slowest=None):
+        with self._lock:
+            sql = self.sql.setdefault(BACKGROUND_ROUTE, [0, 0.0, 0.0])
+            sql[0] += statements
+            sql[1] += seconds
+            sql[2] = max(sql[2], seconds if slowest is None else slowest)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            lines += [
+                "# HELP http_request_duration_seconds Время обработки запроса",
+                "# TYPE http_request_duration_seconds histogram",
+            ]
+            for (method, route), histogram in sorted(self.latency.items()):
+                labels = f'method="{method}",route="{route}"'
+                for bound, count in zip(LATENCY_BUCKETS, histogram):
+                    lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {histogram[-1]}')
+                lines.append(f"http_request_duration_seconds_sum{{{labels}}} {histogram[-2]}")
+                lines.append(f"http_request_duration_seconds_count{{{labels}}} {histogram[-1]}")
+
+            lines += ["# HELP http_requests_in_flight Запросы в обработке", "# TYPE http_requests_in_flight gauge"]
+            for (method, route), count in sorted(self.in_flight.items()):
+                lines.append(f'http_requests_in_flight{{method="{method}",route="{route}"}} {count}')
+
+            lines += ["# HELP http_requests_total Обработанные запросы", "# TYPE http_requests_total counter"]
+            for (method, route, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{method="{method}",route="{route}",status="{status}"}} {count}')
+
+            lines += ["# HELP db_statements_total SQL-выражения", "# TYPE db_statements_total counter"]
+            lines += [f'db_statements_total{{route="{route}"}} {sql[0]}' for route, sql in sorted(self.sql.items())]
+            lines += ["# HELP db_statement_seconds_total Время SQL-выражений", "# TYPE db_statement_seconds_total counter"]
+            lines += [f'db_statement_seconds_total{{route="{route}"}} {sql[1]}' for route, sql in sorted(self.sql.items())]
+            lines += ["# HELP db_slowest_statement_seconds Самое медленное SQL-выражение",
+                      "# TYPE db_slowest_statement_seconds gauge"]
+            lines += [f'db_slowest_statement_seconds{{route="{route}"}} {sql[2]}' for route, sql in sorted(self.sql.items())]
+
+        cache = profile_cache.stats()
+        lines += ["# HELP profile_cache_size Профилей в кэше", "# TYPE profile_cache_size gauge",
+                  f"profile_cache_size {cache['size']}"]
+        for name in ("hits", "misses", "evictions"):
+            lines += [f"# TYPE profile_cache_{name}_total counter", f"profile_cache_{name}_total {cache[name]}"]
+        seen = seen_index.stats()
+        lines += ["# HELP seen_index_size Пользователей с загруженным индексом просмотренных", "# TYPE seen_index_size gauge",
+                  f"seen_index_size {seen['size']}"]
+        for name in ("hits", "misses", "evictions"):
+            lines += [f"# TYPE seen_index_{name}_total counter", f"seen_index_{name}_total {seen[name]}"]
+        tokens = auth.token_cache.stats()
+        lines += ["# HELP auth_token_cache_size Проверенных токенов в кэше", "# TYPE auth_token_cache_size gauge",
+                  f"auth_token_cache_size {tokens['size']}"]
+        for name in ("hits", "misses", "evictions"):
+            lines += [f"# TYPE auth_token_cache_{name}_total counter", f"auth_token_cache_{name}_total {tokens[name]}"]
+        lines += ["# HELP app_startup_seconds Фазы старта воркера", "# TYPE app_startup_seconds gauge"]
+        lines += [f'app_startup_seconds{{phase="{phase}"}} {seconds}' for phase, seconds in sorted(startup.timings.items())]
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def render() -> str:
+    return registry.render()
+
+
+def share(work: RequestStats, requests):
+    """Делит SQL общей фоновой операции (work) между запросами, которые её ждали.
+
+    requests — пары (RequestStats запроса или None, вес). Выражения делятся
+    пропорционально весу целыми числами, так что сумма сходится, время —
+    дробно. Доля без запроса уходит в маршрут background.
+    """
+    if not requests or not work.statements:
+        return
+    # Пустой запрос тоже ждал коммита: вес не меньше единицы
+    weights = [max(weight, 1) for _, weight in requests]
+    total = sum(weights)
+    counts = [work.statements * weight // total for weight in weights]
+    for i in range(work.statements - sum(counts)):
+        counts[i % len(counts)] += 1
+    for (stats, _), weight, count in zip(requests, weights, counts):
+        seconds = work.sql_seconds * weight / total
+        if stats is None:
+            registry.add_background_sql(seconds, count, work.slowest_seconds)
+            continue
+        stats.statements += count
+        stats.sql_seconds += seconds
+        if work.slowest_seconds >= stats.slowest_seconds:
+            stats.slowest, stats.slowest_seconds = work.slowest, work.slowest_seconds
+        if stats.captured is not None and work.captured:
+            stats.captured += work.captured
+
+
+def instrument_engine(engine):
+    """Вешает на движок хуки, которые копят SQL-статистику текущего запроса."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - context._metrics_start
+        stats = current_request.get()
+        if stats is None:
+            registry.add_background_sql(seconds)
+            return
+        stats.statements += 1
+        stats.sql_seconds += seconds
+        if seconds >= stats.slowest_seconds:
+            stats.slowest, stats.slowest_seconds = statement, seconds
+        if stats.captured is not None:
+            stats.captured.append((seconds, statement))
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: время ответа, запросы в работе и SQL по шаблону маршрута."""
+
+    def __init__(self, app, routes):
+        self.app = app
+        self.routes = routes
+
+    def _route(self, scope):
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method, route = scope["method"], self._route(scope)
+        stats = RequestStats(capture=SLOW_REQUEST_MS > 0)
+        token = current_request.set(stats)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        registry.start(method, route)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            seconds = time.perf_counter() - start
+            current_request.reset(token)
+            registry.finish(method, route, status, seconds, stats)
+            startup.first_request_done()
+            if SLOW_REQUEST_MS > 0 and seconds * 1000 >= SLOW_REQUEST_MS:
+                logger.warning(
+                    "Slow request %s %s: %.1f ms, %d SQL statements in %.1f ms\n%s",
+                    method, scope["path"], seconds * 1000, stats.statements, stats.sql_seconds * 1000,
+                    "\n".join(f"  {s * 1000:.2f} ms  {statement}" for s, statement in stats.captured)
+                )
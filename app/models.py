@@ -1,9 +1,17 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
+from sqlalchemy import Column, DateTime, Integer, String, ForeignKey, Index, func, text
 from sqlalchemy.orm import relationship
 from app.database import Base
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # Индексы под фильтры /api/profiles/next
+        Index("ix_users_region_age", "region", "age"),
+        Index("ix_users_age", "age"),
+        # Поиск по началу названия машины без учёта регистра ("bmw" найдёт "BMW E46");
+        # на других базах фильтр идёт через lower() без индекса
+        Index("ix_users_car_nocase", text("car COLLATE NOCASE")).ddl_if(dialect="sqlite"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     telegram_id = Column(String, unique=True, nullable=False)
@@ -20,26 +28,71 @@ class User(Base):
 
 class Like(Base):
     __tablename__ = "likes"
+    __table_args__ = (
+        # Один свайп на пару пользователей; индекс также покрывает выборку свайпов пользователя
+        Index("ux_likes_from_to", "from_user_id", "to_user_id", unique=True),
+        # Обратный поиск: кто свайпнул пользователя (проверка взаимного лайка)
+        Index("ix_likes_to_from", "to_user_id", "from_user_id"),
+        # Поиск старых свайпов для очистки (app.retention)
+        Index("ix_likes_created_at", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     from_user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     to_user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    created_at = Column(DateTime, nullable=True, server_default=func.now())
 
     from_user = relationship("User", foreign_keys=[from_user_id], back_populates="likes")
     to_user = relationship("User", foreign_keys=[to_user_id])
 
 class Dislike(Base):
     __tablename__ = "dislikes"
+    __table_args__ = (
+        # Один свайп на пару пользователей; индекс также покрывает выборку свайпов пользователя
+        Index("ux_dislikes_from_to", "from_user_id", "to_user_id", unique=True),
+        # Обратный поиск: кто свайпнул пользователя (проверка взаимного лайка)
+        Index("ix_dislikes_to_from", "to_user_id", "from_user_id"),
+        # Поиск старых свайпов для очистки (app.retention)
+        Index("ix_dislikes_created_at", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     from_user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     to_user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    created_at = Column(DateTime, nullable=True, server_default=func.now())
 
     from_user = relationship("User", foreign_keys=[from_user_id], back_populates="dislikes")
     to_user = relationship("User", foreign_keys=[to_user_id])
 
+class LikeArchive(Base):
+    """Холодное хранилище старых невзаимных лайков. Заархивированные анкеты
+    по-прежнему считаются просмотренными и в выдачу не возвращаются."""
+    __tablename__ = "likes_archive"
+    __table_args__ = (
+        # Выборка лайков пользователя для индекса просмотренных и поиска
+        Index("ix_likes_archive_from_to", "from_user_id", "to_user_id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    from_user_id = Column(Integer, nullable=False)
+    to_user_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, nullable=False, server_default=func.now())
+
+class IdSequence(Base):
+    """Счётчики глобальных id строк в шардах свайпов (см. app.sharding.IdAllocator)."""
+    __tablename__ = "id_sequences"
+
+    name = Column(String, primary_key=True)
+    next_id = Column(Integer, nullable=False)
+
 class Match(Base):
     __tablename__ = "matches"
+    __table_args__ = (
+        # Пара хранится канонически: user1_id < user2_id (см. crud.canonical_pair)
+        Index("ux_matches_user1_user2", "user1_id", "user2_id", unique=True),
+        Index("ix_matches_user2_user1", "user2_id", "user1_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user1_id = Column(Integer, ForeignKey("users.id"), nullable=False)
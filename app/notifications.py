@@ -0,0 +1,89 @@
+"""Уведомления о новых матчах через pub/sub.
+
+crud отмечает созданные матчи в session.info, а после успешного коммита
+хук сессии публикует событие обоим участникам. Подписчики (SSE-стрим
+/api/matches/{user_id}/stream) ждут события в очереди и не обращаются к базе.
+
+InProcessMatchHub работает внутри одного процесса. Для нескольких воркеров
+его можно заменить реализацией MatchHub поверх общего брокера (например,
+Redis pub/sub), присвоив её match_hub.
+"""
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import AsyncContextManager
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class MatchHub(ABC):
+    @abstractmethod
+    def subscribe(self, user_id: int) -> AsyncContextManager[asyncio.Queue]:
+        """Асинхронный контекстный менеджер, отдающий asyncio.Queue событий пользователя."""
+
+    @abstractmethod
+    def publish(self, user_id: int, payload: dict):
+        """Отправляет событие подписчикам user_id; можно вызывать из любого потока."""
+
+
+class InProcessMatchHub(MatchHub):
+    def __init__(self):
+        # user_id -> {(цикл событий, очередь)}
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    @asynccontextmanager
+    async def subscribe(self, user_id: int):
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(SUBSCRIBER_QUEUE_SIZE))
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscriber)
+        try:
+            yield subscriber[1]
+        finally:
+            with self._lock:
+                subscribers = self._subscribers.get(user_id)
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[user_id]
+
+    def publish(self, user_id: int, payload: dict):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for loop, queue in subscribers:
+            # Публикация приходит из пула потоков или из run_sync, а очередь
+            # принадлежит циклу событий подписчика
+            loop.call_soon_threadsafe(_put_nowait, queue, payload)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+def _put_nowait(queue, payload):
+    # Медленный клиент теряет события сверх SUBSCRIBER_QUEUE_SIZE, а не копит память
+    if not queue.full():
+        queue.put_nowait(payload)
+
+
+match_hub = InProcessMatchHub()
+
+
+def record_match(db: Session, match_id: int, user1_id: int, user2_id: int):
+    """Запоминает созданный матч; событие уйдёт только после коммита сессии."""
+    db.info.setdefault("new_matches", []).append((match_id, user1_id, user2_id))
+
+
+@event.listens_for(Session, "after_commit")
+def publish_new_matches(session):
+    for match_id, user1_id, user2_id in session.info.pop("new_matches", ()):
+        match_hub.publish(user1_id, {"type": "match", "match_id": match_id, "user_id": user2_id})
+        match_hub.publish(user2_id, {"type": "match", "match_id": match_id, "user_id": user1_id})
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_new_matches(session):
+    session.info.pop("new_matches", None)
@@ -0,0 +1,267 @@
+"""Ранжирование анкет для /api/profiles/next.
+
+Ranker держит в памяти матрицу признаков всех пользователей (numpy-массивы,
+индексированные по id): возраст, регион, марка машины, активность. За один
+векторный проход он оценивает всех непросмотренных кандидатов и отдаёт
+top-k лучших; следующие запросы того же пользователя берут анкеты из этой
+очереди без пересчёта.
+
+Матрица загружается лениво одним запросом, дальше обновляется точечно из
+crud (create_user, update_user, update_about, свайпы) и полностью
+перечитывается раз в RANKING_RELOAD_SECONDS, чтобы подхватить изменения
+других воркеров. Перечитывание идёт в фоновом потоке, а готовая матрица
+подменяет старую под блокировкой, поэтому запросы его не ждут. Скорер подменяемый: любой объект с методом
+score(features, viewer_id, candidates, liked_viewer) -> массив оценок.
+
+Без numpy или с RANKED_DISCOVERY=0 ранжирование выключено, и
+get_next_profile выбирает анкеты случайно, как раньше.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app import database, models
+from app.schemas import MAX_AGE
+from app.seen import seen_index
+from app.sharding import all_sessions
+
+try:
+    import numpy as np
+except ImportError:  # numpy необязателен
+    np = None
+
+RANKED_DISCOVERY = os.getenv("RANKED_DISCOVERY", "1") != "0"
+RANKING_TOP_K = int(os.getenv("RANKING_TOP_K", "20"))
+RANKING_RELOAD_SECONDS = float(os.getenv("RANKING_RELOAD_SECONDS", "300"))
+# Сколько очередей top-k держим одновременно
+RANKING_QUEUES = 10000
+
+logger = logging.getLogger(__name__)
+
+
+def car_make(car) -> str:
+    return car.split()[0].lower() if car and car.strip() else ""
+
+
+class Features:
+    """Признаки пользователей; строка массива = id пользователя."""
+
+    def __init__(self, size: int = 0):
+        self.present = np.zeros(size, dtype=bool)
+        self.age = np.zeros(size, dtype=np.int32)
+        self.region = np.zeros(size, dtype=np.int32)
+        self.car_make = np.zeros(size, dtype=np.int32)
+        self.activity = np.zeros(size, dtype=np.float32)
+        # Коды категорий; 0 — пустое значение
+        self.codes = {"region": {"": 0}, "car_make": {"": 0}}
+
+    @property
+    def size(self) -> int:
+        return len(self.present)
+
+    def code(self, kind: str, value: str) -> int:
+        codes = self.codes[kind]
+        return codes.setdefault(value, len(codes))
+
+    def reserve(self, user_id: int):
+        if user_id < self.size:
+            return
+        size = max(user_id + 1, self.size * 2, 1024)
+        for name in ("present", "age", "region", "car_make", "activity"):
+            old = getattr(self, name)
+            new = np.zeros(size, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def set_user(self, user_id: int, age, region, car):
+        self.reserve(user_id)
+        self.present[user_id] = True
+        # Старые записи в базе могли пройти без проверки схемы
+        self.age[user_id] = min(max(age or 0, 0), MAX_AGE)
+        self.region[user_id] = self.code("region", region or "")
+        self.car_make[user_id] = self.code("car_make", car_make(car))
+
+    def add_activity(self, user_id: int):
+        if user_id < self.size:
+            self.activity[user_id] += 1
+
+
+class DefaultScorer:
+    """Линейная оценка: регион, близость возраста, марка машины, активность
+    кандидата и то, что кандидат уже лайкнул смотрящего. Небольшой шум
+    перемешивает анкеты с равной оценкой."""
+
+    def __init__(self, region=2.0, age_gap=0.1, car_make=1.0, activity=0.5, liked_viewer=3.0, noise=0.5):
+        self.weights = dict(region=region, age_gap=age_gap, car_make=car_make,
+                            activity=activity, liked_viewer=liked_viewer, noise=noise)
+        self.rng = np.random.default_rng()
+
+    def score(self, f: Features, viewer_id: int, candidates, liked_viewer):
+        w = self.weights
+        scores = w["noise"] * self.rng.random(len(candidates), dtype=np.float32)
+        if f.region[viewer_id]:
+            scores += w["region"] * (f.region[candidates] == f.region[viewer_id])
+        if f.age[viewer_id]:
+            scores -= w["age_gap"] * np.abs(f.age[candidates] - f.age[viewer_id])
+        if f.car_make[viewer_id]:
+            scores += w["car_make"] * (f.car_make[candidates] == f.car_make[viewer_id])
+        scores += w["activity"] * np.log1p(f.activity[candidates])
+        scores += w["liked_viewer"] * liked_viewer[candidates]
+        return scores
+
+
+class Ranker:
+    def __init__(self, scorer=None, top_k: int = RANKING_TOP_K):
+        self.scorer = scorer
+        self.top_k = top_k
+        self.features = None
+        self.loaded_at = 0.0
+        # (viewer_id, фильтры) -> список id в порядке убывания оценки
+        self._queues = OrderedDict()
+        # Обновления, пришедшие во время перечитывания матрицы; None — перечитывания нет
+        self._pending = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return np is not None and RANKED_DISCOVERY
+
+    def ensure_loaded(self, db: Session):
+        """Загружает матрицу при первом обращении; устаревшую перечитывает в фоне."""
+        if self.features is None:
+            # Первая загрузка, если её не сделал прогрев при старте, идёт в запросе
+            self.reload(db)
+            return
+        if time.monotonic() - self.loaded_at < RANKING_RELOAD_SECONDS:
+            return
+        with self._lock:
+            if self._pending is not None:
+                return  # уже перечитывается
+            self._pending = []
+        threading.Thread(target=self.reload_in_background, name="ranker-reload", daemon=True).start()
+
+    def reload_in_background(self):
+        db = database.SessionLocal()
+        try:
+            self.reload(db)
+        except Exception:
+            logger.exception("Перезагрузка признаков для ранжирования не удалась")
+            with self._lock:
+                # Следующая попытка — через RANKING_RELOAD_SECONDS
+                self._pending = None
+                self.loaded_at = time.monotonic()
+        finally:
+            db.close()
+
+    def reload(self, db: Session):
+        """Читает матрицу целиком и подменяет текущую одним присваиванием.
+
+        Пока идёт чтение, запросы ранжируют по старой матрице, а точечные
+        обновления копятся в _pending и применяются к новой перед подменой.
+        """
+        with self._lock:
+            if self._pending is None:
+                self._pending = []
+        max_id = db.query(func.max(models.User.id)).scalar() or 0
+        features = Features(max_id + 1)
+        for user_id, age, region, car in db.query(
+            models.User.id, models.User.age, models.User.region, models.User.car
+        ).yield_per(10000):
+            features.set_user(user_id, age, region, car)
+        for swipes in all_sessions(db):
+            for model in (models.Like, models.Dislike):
+                for user_id, count in swipes.query(model.from_user_id, func.count()).group_by(model.from_user_id):
+                    if user_id < features.size:
+                        features.activity[user_id] += count
+        with self._lock:
+            # Свайп, закоммиченный во время чтения, может учесться дважды:
+            # активность — грубый признак, это не страшно
+            for apply in self._pending or ():
+                apply(features)
+            self._pending = None
+            # Скорер создаётся до публикации матрицы: другой поток увидит
+            # загруженные признаки и сразу начнёт ранжировать
+            if self.scorer is None:
+                self.scorer = DefaultScorer()
+            self.features = features
+            self.loaded_at = time.monotonic()
+            self._queues.clear()
+
+    def _update(self, apply):
+        # Применяет точечное обновление к текущей матрице и к перечитываемой
+        with self._lock:
+            if self.features is not None:
+                apply(self.features)
+            if self._pending is not None:
+                self._pending.append(apply)
+
+    def upsert_user(self, user: models.User):
+        if not self.enabled:
+            return
+        user_id, age, region, car = user.id, user.age, user.region, user.car
+        self._update(lambda features: features.set_user(user_id, age, region, car))
+
+    def record_swipe(self, from_user_id: int):
+        if not self.enabled:
+            return
+        self._update(lambda features: features.add_activity(from_user_id))
+
+    def rank(self, db: Session, viewer_id: int, region=None, min_age=None, max_age=None, k=None):
+        """Возвращает до k id лучших непросмотренных кандидатов."""
+        self.ensure_loaded(db)
+        seen = seen_index.get(db, viewer_id)
+        # Лайки смотрящему лежат в шардах их авторов, поэтому спрашиваем все шарды
+        liked_viewer_ids = [row[0] for likes in all_sessions(db) for row in likes.query(models.Like.from_user_id).filter(
+            models.Like.to_user_id == viewer_id
+        )]
+        with self._lock:
+            f = self.features
+            f.reserve(viewer_id)
+            mask = f.present.copy()
+            mask[viewer_id] = False
+            # Копия, а не frombuffer: экспорт буфера запретил бы seen_index дописывать массив
+            seen_ids = np.array(seen, dtype=np.int64)
+            mask[seen_ids[seen_ids < f.size]] = False
+            if region is not None:
+                mask &= f.region == f.codes["region"].get(region, -1)
+            if min_age is not None:
+                mask &= f.age >= min_age
+            if max_age is not None:
+                mask &= f.age <= max_age
+            candidates = np.flatnonzero(mask)
+            if not len(candidates):
+                return []
+            liked_viewer = np.zeros(f.size, dtype=np.float32)
+            liked_ids = np.array([i for i in liked_viewer_ids if i < f.size], dtype=np.int64)
+            liked_viewer[liked_ids] = 1.0
+            scores = self.scorer.score(f, viewer_id, candidates, liked_viewer)
+        k = min(k or self.top_k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return candidates[top].tolist()
+
+    def next_candidate(self, db: Session, viewer_id: int, region=None, min_age=None, max_age=None):
+        key = (viewer_id, region, min_age, max_age)
+        with self._lock:
+            queue = self._queues.pop(key, [])
+        for attempt in range(2):
+            # Анкеты из очереди могли быть просмотрены с тех пор, как её посчитали
+            while queue:
+                user_id = queue.pop(0)
+                if not seen_index.contains(db, viewer_id, user_id):
+                    with self._lock:
+                        self._queues[key] = queue
+                        while len(self._queues) > RANKING_QUEUES:
+                            self._queues.popitem(last=False)
+                    return user_id
+            if attempt == 0:
+                queue = self.rank(db, viewer_id, region, min_age, max_age)
+        return None
+
+
+ranker = Ranker()
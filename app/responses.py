@@ -0,0 +1,60 @@
+"""Быстрая сериализация ответов, ETag и проекция полей.
+
+Маршруты с профилями и совпадениями собирают словари из колонок и отдают
+их сразу байтами (orjson, если установлен, иначе json), минуя
+jsonable_encoder и повторную валидацию response_model. Модели из schemas
+по-прежнему описывают ответы в OpenAPI.
+"""
+import hashlib
+import json
+
+from fastapi import HTTPException, Request, Response
+
+try:
+    import orjson
+except ImportError:  # orjson есть в requirements.txt; без него — стандартный json
+    orjson = None
+
+
+def dumps(payload) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def etag_response(request: Request, payload) -> Response:
+    """JSON-ответ с ETag; при совпадении If-None-Match отдаёт 304 без тела."""
+    body = dumps(payload)
+    etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in (tag.strip() for tag in if_none_match.split(","))):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def parse_fields(fields, allowed):
+    """Разбирает параметр fields=a,b,c; id возвращается всегда.
+
+    None означает все поля из allowed.
+    """
+    if not fields:
+        return tuple(allowed)
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in requested if name not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return tuple(name for name in allowed if name == "id" or name in requested)
+
+
+def project(obj, fields) -> dict:
+    if isinstance(obj, dict):
+        return {name: obj[name] for name in fields}
+    return {name: getattr(obj, name) for name in fields}
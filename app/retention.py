@@ -0,0 +1,167 @@
+"""Очистка старых свайпов, чтобы таблицы likes и dislikes не росли бесконечно.
+
+Дизлайки старше DISLIKE_RETENTION_DAYS удаляются: эти анкеты снова попадают
+в выдачу /api/profiles/next. Невзаимные лайки старше LIKE_RETENTION_DAYS
+переносятся в холодную таблицу likes_archive: эти анкеты остаются
+просмотренными (индекс seen и поиск читают архив) и в выдачу не возвращаются,
+а встречный лайк по-прежнему создаёт матч (crud.reciprocal_likes ищет и в
+архиве). Взаимные лайки не трогаем.
+
+Работа идёт пачками по RETENTION_BATCH строк, каждая пачка — отдельная
+короткая транзакция, между пачками пауза RETENTION_PAUSE_MS, чтобы запись
+свайпов не ждала блокировку. Отчёт содержит число убранных строк и размеры
+таблиц и индексов после очистки.
+
+Запускается из cron через compact.py или внутри приложения раз в
+RETENTION_INTERVAL_SECONDS (включайте в одном воркере). Индекс просмотренных
+анкет сбрасывается только в процессе, который выполнял очистку; остальные
+воркеры увидят вернувшиеся анкеты после перезапуска.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import exists, func, select, text
+from starlette.concurrency import run_in_threadpool
+
+from app import models, sharding
+from app.seen import seen_index
+
+DISLIKE_RETENTION_DAYS = float(os.getenv("DISLIKE_RETENTION_DAYS", "30"))
+LIKE_RETENTION_DAYS = float(os.getenv("LIKE_RETENTION_DAYS", "90"))
+RETENTION_BATCH = int(os.getenv("RETENTION_BATCH", "500"))
+RETENTION_PAUSE_MS = float(os.getenv("RETENTION_PAUSE_MS", "20"))
+# 0 — очистка внутри приложения выключена, только compact.py
+RETENTION_INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", "0"))
+
+logger = logging.getLogger(__name__)
+
+likes = models.Like.__table__
+dislikes = models.Dislike.__table__
+likes_archive = models.LikeArchive.__table__
+matches = models.Match.__table__
+
+
+def cutoff(days: float) -> datetime:
+    # server_default func.now() в SQLite пишет время в UTC
+    return datetime.utcnow() - timedelta(days=days)
+
+
+def compact_batches(engine, table, condition, handle, batch, pause):
+    """Обходит строки table, подходящие под condition, пачками по id и
+    передаёт каждую пачку в handle(connection, rows) внутри своей транзакции."""
+    with engine.connect() as connection:
+        # Верхняя граница по индексу created_at: дальше неё старых строк нет,
+        # и обход не дочитывает таблицу до конца
+        upper = connection.execute(select(func.max(table.c.id)).where(condition)).scalar()
+    total, last_id = 0, 0
+    while upper is not None:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                select(table.c.id, table.c.from_user_id, table.c.to_user_id, table.c.created_at)
+                .where(condition, table.c.id > last_id, table.c.id <= upper)
+                .order_by(table.c.id)
+                .limit(batch)
+            ).all()
+            if not rows:
+                break
+            handle(connection, rows)
+        last_id = rows[-1].id
+        total += len(rows)
+        # Индекс просмотренных перечитается из базы при следующем обращении
+        for from_user_id in {row.from_user_id for row in rows}:
+            seen_index.invalidate(from_user_id)
+        time.sleep(pause)
+    return total
+
+
+def expire_dislikes(engine, days=DISLIKE_RETENTION_DAYS, batch=RETENTION_BATCH, pause=RETENTION_PAUSE_MS / 1000):
+    def delete(connection, rows):
+        connection.execute(dislikes.delete().where(dislikes.c.id.in_([row.id for row in rows])))
+
+    return compact_batches(engine, dislikes, dislikes.c.created_at < cutoff(days), delete, batch, pause)
+
+
+def archive_likes(engine, days=LIKE_RETENTION_DAYS, batch=RETENTION_BATCH, pause=RETENTION_PAUSE_MS / 1000):
+    # Взаимность проверяем по матчу, а не по встречному лайку: с шардами
+    # встречный лайк лежит в другой базе, а матч есть в шардах обоих участников
+    unreciprocated = ~exists().where(
+        ((matches.c.user1_id == likes.c.from_user_id) & (matches.c.user2_id == likes.c.to_user_id)) |
+        ((matches.c.user1_id == likes.c.to_user_id) & (matches.c.user2_id == likes.c.from_user_id))
+    )
+
+    def archive(connection, rows):
+        connection.execute(likes_archive.insert(), sharding.with_ids(likes_archive, [
+            {"from_user_id": row.from_user_id, "to_user_id": row.to_user_id, "created_at": row.created_at}
+            for row in rows
+        ]))
+        connection.execute(likes.delete().where(likes.c.id.in_([row.id for row in rows])))
+
+    condition = (likes.c.created_at < cutoff(days)) & unreciprocated
+    return compact_batches(engine, likes, condition, archive, batch, pause)
+
+
+def table_sizes(engine, tables=(likes, dislikes, likes_archive)) -> dict:
+    """Строки и байты таблиц и их индексов; байты — где база умеет их отдать."""
+    sizes = {}
+    with engine.connect() as connection:
+        for table in tables:
+            sizes[table.name] = {"rows": connection.execute(select(func.count()).select_from(table)).scalar()}
+        if engine.dialect.name == "sqlite":
+            try:
+                pages = dict(connection.execute(text("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name")).all())
+            except Exception:
+                # SQLite собран без dbstat
+                pages = {}
+            if pages:
+                for table in tables:
+                    sizes[table.name]["table_bytes"] = pages.get(table.name, 0)
+                    sizes[table.name]["index_bytes"] = sum(
+                        pages.get(index.name, 0) for index in table.indexes
+                    )
+            free_pages = connection.execute(text("PRAGMA freelist_count")).scalar()
+            page_size = connection.execute(text("PRAGMA page_size")).scalar()
+            sizes["free_bytes"] = free_pages * page_size
+        elif engine.dialect.name == "postgresql":
+            for table in tables:
+                sizes[table.name]["table_bytes"] = connection.execute(
+                    text("SELECT pg_relation_size(:t)"), {"t": table.name}).scalar()
+                sizes[table.name]["index_bytes"] = connection.execute(
+                    text("SELECT pg_indexes_size(:t)"), {"t": table.name}).scalar()
+    return sizes
+
+
+def compact(engine=None, dislike_days=DISLIKE_RETENTION_DAYS, like_days=LIKE_RETENTION_DAYS,
+            batch=RETENTION_BATCH, pause=RETENTION_PAUSE_MS / 1000) -> dict:
+    """Очищает engine или, по умолчанию, все базы со свайпами (шарды или основную)."""
+    engines = [engine] if engine is not None else sharding.swipe_engines()
+    started = time.perf_counter()
+    report = {"dislikes_expired": 0, "likes_archived": 0}
+    for swipes in engines:
+        report["dislikes_expired"] += expire_dislikes(swipes, dislike_days, batch, pause)
+        report["likes_archived"] += archive_likes(swipes, like_days, batch, pause)
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    if len(engines) == 1:
+        report["sizes"] = table_sizes(engines[0])
+    else:
+        report["shards"] = [table_sizes(swipes) for swipes in engines]
+    return report
+
+
+async def run_periodically(interval: float = RETENTION_INTERVAL_SECONDS):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            report = await run_in_threadpool(compact)
+            logger.info("Очистка свайпов: %s", report)
+        except Exception:
+            logger.exception("Очистка свайпов не удалась")
+
+
+def schedule():
+    """Запускает периодическую очистку, если она включена; возвращает задачу или None."""
+    if RETENTION_INTERVAL_SECONDS <= 0:
+        return None
+    return asyncio.get_running_loop().create_task(run_periodically())
@@ -1,8 +1,14 @@
-from pydantic import BaseModel
+from typing import List, Literal, Optional
+from pydantic import BaseModel, ConfigDict, Field
+
+# Верхняя граница возраста в анкете
+MAX_AGE = 150
+# Сколько свайпов принимает один запрос /api/swipes
+SWIPE_BATCH_MAX = 100
 
 class UserBase(BaseModel):
     name: str = ""
-    age: int = 0
+    age: int = Field(0, ge=0, le=MAX_AGE)
     photo_url: str = ""
     car: str = ""
     region: str = ""
@@ -15,24 +21,74 @@ class UserUpdate(UserBase):
     pass
 
 class UserRead(UserBase):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
     telegram_id: str
+    photo_url: Optional[str] = ""
+    about: Optional[str] = ""
+
+class ProfileRead(BaseModel):
+    # Анкета другого пользователя: без telegram_id
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    name: str
+    age: int
+    photo_url: Optional[str] = None
+    car: str
+    region: str
+    about: Optional[str] = None
+
+class NextProfile(BaseModel):
+    profile: Optional[ProfileRead] = None
+    message: Optional[str] = None
+
+class MatchUser(BaseModel):
+    # Строка списка совпадений: только колонки, нужные для списка
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    name: str
+    age: int
+    photo_url: Optional[str] = None
+    car: str
+    region: str
+
+class MatchPage(BaseModel):
+    matches: List[MatchUser]
+    next_after: Optional[int] = None
 
-    class Config:
-        orm_mode = True
+class SearchPage(BaseModel):
+    profiles: List[ProfileRead]
+    next_offset: Optional[int] = None
 
 class LikeCreate(BaseModel):
     from_user_id: int
     to_user_id: int
 
+class SwipeAction(BaseModel):
+    to_user_id: int
+    action: Literal["like", "dislike"]
+
+class SwipeBatch(BaseModel):
+    swipes: List[SwipeAction] = Field(..., max_length=SWIPE_BATCH_MAX)
+
 class MatchRead(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
     user1_id: int
     user2_id: int
 
-    class Config:
-        orm_mode = True
-
 class AboutUpdate(BaseModel):
     user_id: int
-    about: str
\ No newline at end of file
+    about: str
+class InitData(BaseModel):
+    # Строка Telegram.WebApp.initData как есть
+    init_data: str
+
+class SessionToken(BaseModel):
+    token: str
+    expires_in: int
+    user: UserRead
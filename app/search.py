@@ -0,0 +1,81 @@
+"""Полнотекстовый поиск анкет по имени, машине и тексту «о себе».
+
+В SQLite индекс — виртуальная таблица FTS5 users_fts с внешним содержимым
+(content='users'): тексты хранятся только в users, а users_fts держит
+инвертированный индекс. Синхронизацию делают триггеры, поэтому индекс
+обновляется при любой записи в users: из crud, из transfer.py, из миграций.
+
+Запрос пользователя разбивается на слова, каждое ищется по префиксу ("bmw"
+найдёт "BMW", "e46" — "E46"), все слова должны совпасть. Результаты
+упорядочены по bm25, машина весит больше имени, имя — больше «о себе».
+
+На других базах или в SQLite без FTS5 поиск работает через LIKE, без ранжирования.
+"""
+import re
+
+from sqlalchemy import text
+
+FTS_TABLE = "users_fts"
+# Веса bm25 по колонкам: name, car, about
+RANK = "bm25(2.0, 5.0, 1.0)"
+
+DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"name, car, about, content='users', content_rowid='id', "
+    f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    f"CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, name, car, about) VALUES (new.id, new.name, new.car, new.about); END",
+    f"CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, car, about) "
+    f"VALUES ('delete', old.id, old.name, old.car, old.about); END",
+    # Только при изменении индексируемых колонок: смена фото или региона индекс не трогает
+    f"CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF name, car, about ON users BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, car, about) "
+    f"VALUES ('delete', old.id, old.name, old.car, old.about); "
+    f"INSERT INTO {FTS_TABLE}(rowid, name, car, about) VALUES (new.id, new.name, new.car, new.about); END",
+)
+
+_available = {}
+
+
+def create_index(connection):
+    """Создаёт users_fts и триггеры, если их нет, и индексирует уже существующие анкеты."""
+    if connection.dialect.name != "sqlite" or not fts5_supported(connection):
+        return False
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": FTS_TABLE}
+    ).scalar()
+    for statement in DDL:
+        connection.execute(text(statement))
+    if not exists:
+        connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('rank', :rank)"), {"rank": RANK})
+        connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    _available.clear()
+    return True
+
+
+def fts5_supported(connection) -> bool:
+    return bool(connection.execute(text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")).scalar())
+
+
+def available(connection) -> bool:
+    """Есть ли в базе users_fts; результат запоминается на движок."""
+    engine = connection.engine
+    if engine not in _available:
+        _available[engine] = connection.dialect.name == "sqlite" and bool(connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": FTS_TABLE}
+        ).scalar())
+    return _available[engine]
+
+
+def words(query: str):
+    return re.findall(r"\w+", query.lower())
+
+
+def match_query(query: str) -> str:
+    """Запрос FTS5 из пользовательского текста: каждое слово — префикс, все обязательны.
+
+    Слова берутся в кавычки, поэтому операторы FTS5 (OR, NEAR, *) во вводе
+    пользователя не работают и не ломают запрос.
+    """
+    return " ".join(f'"{word}"*' for word in words(query))
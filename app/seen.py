@@ -0,0 +1,92 @@
+import os
+import threading
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+from sqlalchemy.orm import Session
+from app import models
+from app.sharding import session_for
+
+# Для скольких пользователей держать массивы просмотренных; давно не заходившие вытесняются
+SEEN_INDEX_SIZE = int(os.getenv("SEEN_INDEX_SIZE", "10000"))
+
+
+class SeenIndex:
+    """Индекс просмотренных профилей: для каждого пользователя хранит
+    отсортированный массив id, которые он уже лайкнул или дизлайкнул,
+    включая лайки, перенесённые в likes_archive.
+
+    Массив загружается из базы лениво, при первом обращении, и дальше
+    поддерживается в актуальном состоянии через add() при записи свайпов.
+    Массивы держатся для maxsize пользователей в порядке LRU; вытесненный
+    массив при следующем обращении снова читается из базы.
+    """
+
+    def __init__(self, maxsize: int = SEEN_INDEX_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, db: Session, user_id: int) -> array:
+        db = session_for(db, user_id)
+        liked = db.query(models.Like.to_user_id).filter(models.Like.from_user_id == user_id)
+        disliked = db.query(models.Dislike.to_user_id).filter(models.Dislike.from_user_id == user_id)
+        archived = db.query(models.LikeArchive.to_user_id).filter(models.LikeArchive.from_user_id == user_id)
+        ids = array("q", sorted({row[0] for row in liked.union_all(disliked, archived)}))
+        # Загрузка идёт без блокировки, чтобы не держать её на время запроса;
+        # если параллельно кто-то уже загрузил массив, оставляем его версию
+        with self._lock:
+            seen = self._seen.setdefault(user_id, ids)
+            self._seen.move_to_end(user_id)
+            while len(self._seen) > self.maxsize:
+                self._seen.popitem(last=False)
+                self.evictions += 1
+            return seen
+
+    def get(self, db: Session, user_id: int) -> array:
+        with self._lock:
+            seen = self._seen.get(user_id)
+            if seen is not None:
+                self._seen.move_to_end(user_id)
+                self.hits += 1
+                return seen
+            self.misses += 1
+        return self._load(db, user_id)
+
+    def contains(self, db: Session, user_id: int, target_id: int) -> bool:
+        seen = self.get(db, user_id)
+        i = bisect_left(seen, target_id)
+        return i < len(seen) and seen[i] == target_id
+
+    def add(self, user_id: int, target_id: int):
+        # Если индекс пользователя ещё не загружен, он подтянет запись из базы сам
+        with self._lock:
+            seen = self._seen.get(user_id)
+            if seen is None:
+                return
+            i = bisect_left(seen, target_id)
+            if i == len(seen) or seen[i] != target_id:
+                insort(seen, target_id)
+
+    def invalidate(self, user_id: int = None):
+        with self._lock:
+            if user_id is None:
+                self._seen.clear()
+            else:
+                self._seen.pop(user_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._seen),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+seen_index = SeenIndex()
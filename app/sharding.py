@@ -0,0 +1,234 @@
+"""Шардирование свайпов по from_user_id между несколькими базами SQLite.
+
+Пользователи остаются в основной базе, а likes, dislikes, matches и
+likes_archive живут в шардах из SWIPE_SHARDS (URL через запятую). Свайп
+пишется в шард своего автора: shard = from_user_id % N. У каждого шарда
+свой файл и своя блокировка на запись, поэтому запись свайпов
+масштабируется числом шардов.
+
+Матч хранится в шарде меньшего id пары (его id отдаётся клиенту) и копией
+в шарде второго участника, так что список совпадений читается из одного
+шарда. Проверка взаимного лайка идёт в шард того, кого лайкнули.
+
+Лайк записывается, а встречный ищется под блокировкой на запись шардов
+обоих участников (lock_shards). Без неё два встречных лайка из разных
+сессий могли проверить чужой шард до коммита друг друга, и матч не
+появлялся ни у кого. Шарды захватываются по возрастанию номера, поэтому
+транзакции не ждут друг друга по кругу.
+
+crud получает сессию шарда через session_for(db, user_id): без шардов это
+сама db, и код работает как раньше. Сессии шардов привязаны к основной
+сессии: коммитятся вместе с ней (перед её коммитом) и закрываются, когда
+заканчивается её транзакция. Коммит не атомарен между файлами, но все
+записи свайпов идемпотентны, а повторный лайк без матча заново проверяет
+взаимность, так что повтор запроса доводит дело до конца.
+
+Автоинкремент у каждого файла свой, поэтому id строк в шардах выдаёт
+IdAllocator из таблицы id_sequences основной базы: процесс берёт блок из
+SWIPE_ID_BLOCK id одним UPDATE и раздаёт его без обращений к базе. id
+лайков и матчей уникальны во всех шардах и не меняются при переносе
+строк между шардами; обе копии матча хранят один id.
+
+Раскладку по шардам меняет rebalance.py.
+"""
+import os
+import threading
+
+from sqlalchemy import event, exc, false, func, select, update
+from sqlalchemy.orm import Session, sessionmaker
+
+from app import database, models
+
+# Колонки, по которым строка попадает в шард; первая — шард основной копии,
+# матч лежит в шардах обоих участников
+SHARD_KEYS = {
+    "likes": ("from_user_id",),
+    "dislikes": ("from_user_id",),
+    "matches": ("user1_id", "user2_id"),
+    "likes_archive": ("from_user_id",),
+}
+
+# Сколько id процесс резервирует за одно обращение к основной базе
+SWIPE_ID_BLOCK = int(os.getenv("SWIPE_ID_BLOCK", "1000"))
+
+# Таблицы, которые живут в шардах
+SHARDED_TABLES = (
+    models.Like.__table__,
+    models.Dislike.__table__,
+    models.Match.__table__,
+    models.LikeArchive.__table__,
+)
+
+
+class ShardRouter:
+    def __init__(self, urls):
+        self.urls = list(urls)
+        self.engines = [database.make_engine(url) for url in self.urls]
+        # expire_on_commit=False: лайки и матчи читаются после коммита и закрытия сессии шарда
+        self.sessionmakers = [
+            sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+            for engine in self.engines
+        ]
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.engines)
+
+    def shard_for(self, user_id: int) -> int:
+        return user_id % len(self.engines)
+
+
+router = ShardRouter(database.SWIPE_SHARD_URLS)
+
+
+def enabled() -> bool:
+    return router.enabled
+
+
+def swipe_engines():
+    """Движки, в которых лежат свайпы: шарды или основная база."""
+    return router.engines if router.enabled else [database.engine]
+
+
+class IdAllocator:
+    """Выдаёт глобальные id для строк шардированных таблиц блоками из id_sequences."""
+
+    def __init__(self, block: int = SWIPE_ID_BLOCK):
+        self.block = block
+        # таблица -> [следующий id, конец блока)
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    def take(self, table_name: str, count: int):
+        ids = []
+        with self._lock:
+            while len(ids) < count:
+                start, end = self._blocks.get(table_name, (0, 0))
+                if start == end:
+                    start, end = self._reserve(table_name, max(self.block, count - len(ids)))
+                taken = min(end - start, count - len(ids))
+                ids += range(start, start + taken)
+                self._blocks[table_name] = (start + taken, end)
+        return ids
+
+    def _reserve(self, table_name: str, size: int):
+        sequences = models.IdSequence.__table__
+        with database.engine.begin() as connection:
+            # UPDATE берёт блокировку на запись: блоки разных процессов не пересекаются
+            end = connection.execute(
+                update(sequences).where(sequences.c.name == table_name)
+                .values(next_id=sequences.c.next_id + size).returning(sequences.c.next_id)
+            ).scalar()
+        if end is None:
+            self.sync(table_name)
+            return self._reserve(table_name, size)
+        return end - size, end
+
+    def sync(self, table_name: str, engines=None):
+        """Ставит счётчик за максимальный id таблицы во всех базах (после rebalance.py и импорта)."""
+        table = models.Base.metadata.tables[table_name]
+        max_id = 0
+        for engine in {database.engine, *(router.engines if engines is None else engines)}:
+            with engine.connect() as connection:
+                if engine.dialect.has_table(connection, table_name):
+                    max_id = max(max_id, connection.execute(select(func.max(table.c.id))).scalar() or 0)
+        sequences = models.IdSequence.__table__
+        try:
+            with database.engine.begin() as connection:
+                current = connection.execute(
+                    select(sequences.c.next_id).where(sequences.c.name == table_name)
+                ).scalar()
+                if current is None:
+                    connection.execute(sequences.insert().values(name=table_name, next_id=max_id + 1))
+                elif current <= max_id:
+                    connection.execute(
+                        update(sequences).where(sequences.c.name == table_name).values(next_id=max_id + 1)
+                    )
+        except exc.IntegrityError:
+            # Счётчик одновременно создал другой процесс
+            pass
+
+
+id_allocator = IdAllocator()
+
+
+def with_ids(table, rows):
+    """Проставляет глобальные id строкам rows (список словарей); без шардов id даёт база."""
+    if router.enabled:
+        for row, row_id in zip(rows, id_allocator.take(table.name, len(rows))):
+            row["id"] = row_id
+    return rows
+
+
+def create_tables():
+    for engine in router.engines:
+        models.Base.metadata.create_all(bind=engine, tables=SHARDED_TABLES)
+        # Шарды не ведутся миграциями: индексы, добавленные в модели позже
+        # таблиц, create_all не создаст
+        for table in SHARDED_TABLES:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
+
+
+def session_for_shard(db: Session, shard: int) -> Session:
+    sessions = db.info.setdefault("shard_sessions", {})
+    if shard not in sessions:
+        if not db.in_transaction():
+            # Корневая транзакция основной сессии определяет жизнь сессий шардов
+            db.begin()
+        sessions[shard] = router.sessionmakers[shard]()
+    return sessions[shard]
+
+
+def session_for(db: Session, user_id: int) -> Session:
+    """Сессия, в которой лежат свайпы user_id; без шардов — сама db."""
+    if not router.enabled:
+        return db
+    return session_for_shard(db, router.shard_for(user_id))
+
+
+def lock_shards(db: Session, user_ids):
+    """Берёт блокировку на запись в шардах пользователей user_ids до конца транзакции db.
+
+    Шарды захватываются по возрастанию номера; передавайте сразу всех
+    участников транзакции, иначе порядок нарушится. Без шардов ничего не
+    делает: запись и так идёт под блокировкой единственной базы.
+    """
+    if not router.enabled:
+        return
+    locked = db.info.setdefault("locked_shards", set())
+    likes = models.Like.__table__
+    for shard in sorted({router.shard_for(user_id) for user_id in user_ids} - locked):
+        # UPDATE без строк: SQLite всё равно берёт блокировку на запись всего файла
+        session_for_shard(db, shard).execute(update(likes).where(false()).values(id=likes.c.id))
+        locked.add(shard)
+
+
+def all_sessions(db: Session):
+    if not router.enabled:
+        return [db]
+    return [session_for_shard(db, shard) for shard in range(len(router.engines))]
+
+
+def group_by_shard(db: Session, items, key=lambda item: item):
+    """Раскладывает items по сессиям шардов: {сессия: [элементы]}."""
+    groups = {}
+    for item in items:
+        groups.setdefault(session_for(db, key(item)), []).append(item)
+    return groups
+
+
+@event.listens_for(Session, "before_commit")
+def commit_shards(session):
+    for shard_session in session.info.get("shard_sessions", {}).values():
+        shard_session.commit()
+
+
+@event.listens_for(Session, "after_transaction_end")
+def close_shards(session, transaction):
+    if transaction.parent is None:
+        # Незакоммиченное в шардах откатывается вместе с основной транзакцией,
+        # блокировки шардов снимаются
+        session.info.pop("locked_shards", None)
+        for shard_session in session.info.pop("shard_sessions", {}).values():
+            shard_session.close()
@@ -0,0 +1,211 @@
+"""Запуск воркера: проверка схемы, прогрев и время холодного старта.
+
+Раньше main.py вызывал create_all при импорте, и каждый воркер (и каждый
+импорт в тестах) перед первым запросом сверял всю схему с базой. Теперь это
+делает lifespan-хук один раз при старте, причём дёшево: отпечаток моделей
+хранится в таблице schema_version, и create_all выполняется, только если
+он изменился. Если база ведётся миграциями Alembic и стоит на head,
+проверка пропускается совсем; DB_SCHEMA_CHECK=0 отключает её явно.
+
+create_all не меняет существующие таблицы, поэтому после него инспектор
+сверяет колонки и индексы с моделями. Если чего-то не хватает (база
+создана старой версией), версия не записывается, а старт падает с
+просьбой применить миграции: python apply_migration.py.
+
+STARTUP_WARMUP=1 перед готовностью воркера открывает соединения пулов,
+загружает матрицу ранжирования и кладёт в кэш профилей последних
+STARTUP_WARM_PROFILES пользователей.
+"""
+import hashlib
+import logging
+import os
+import time
+
+import sqlalchemy as sa
+from sqlalchemy import exc
+from starlette.concurrency import run_in_threadpool
+
+from app import IMPORT_STARTED, database, models, search, sharding
+from app.cache import profile_cache
+from app.ranking import ranker
+
+DB_SCHEMA_CHECK = os.getenv("DB_SCHEMA_CHECK", "1") != "0"
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "0") == "1"
+STARTUP_WARM_PROFILES = int(os.getenv("STARTUP_WARM_PROFILES", "1000"))
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+
+logger = logging.getLogger(__name__)
+
+schema_version = sa.Table(
+    "schema_version", sa.MetaData(),
+    sa.Column("version", sa.String, primary_key=True),
+)
+
+# Длительность фаз старта в секундах: schema, warmup, ready (от импорта до
+# готовности), first_request (от импорта до конца первого запроса)
+timings = {}
+
+
+# Меняется вместе с правилами проверки: отметки, записанные старой проверкой
+# без сверки колонок и индексов, перестают совпадать
+SCHEMA_CHECK_REVISION = "2"
+
+
+class SchemaOutdated(RuntimeError):
+    pass
+
+
+def schema_fingerprint(metadata=models.Base.metadata, extra=search.DDL) -> str:
+    # extra — DDL вне моделей (индекс полнотекстового поиска)
+    parts = [SCHEMA_CHECK_REVISION, *extra]
+    for table in sorted(metadata.tables.values(), key=lambda t: t.name):
+        parts.append(table.name)
+        parts += [f"{c.name}:{c.type}:{c.nullable}" for c in table.columns]
+        parts += sorted(f"{i.name}:{i.unique}:{','.join(c.name for c in i.columns)}" for i in table.indexes)
+    return hashlib.md5("\n".join(parts).encode()).hexdigest()
+
+
+SCHEMA_VERSION = schema_fingerprint()
+
+
+def alembic_at_head(connection) -> bool:
+    try:
+        from alembic.config import Config
+        from alembic.migration import MigrationContext
+        from alembic.script import ScriptDirectory
+    except ImportError:
+        return False
+    current = set(MigrationContext.configure(connection).get_current_heads())
+    if not current:
+        return False
+    config = Config()
+    config.set_main_option("script_location", MIGRATIONS_DIR)
+    try:
+        heads = set(ScriptDirectory.from_config(config).get_heads())
+    except Exception:
+        logger.warning("Не удалось прочитать миграции Alembic, проверяем схему", exc_info=True)
+        return False
+    return current == heads
+
+
+def stored_version(connection):
+    if not sa.inspect(connection).has_table(schema_version.name):
+        return None
+    return connection.execute(sa.select(schema_version.c.version)).scalar()
+
+
+def missing_schema(connection, tables) -> list:
+    """Колонки и индексы моделей, которых нет в базе: ["likes.created_at", "index ux_likes_from_to", ...]."""
+    inspector = sa.inspect(connection)
+    missing = []
+    for table in tables:
+        if not inspector.has_table(table.name):
+            missing.append(f"table {table.name}")
+            continue
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        missing += [f"{table.name}.{column.name}" for column in table.columns if column.name not in columns]
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        missing += [f"index {index.name}" for index in table.indexes
+                    if index.name not in indexes and created_for(index, connection.dialect.name)]
+    return missing
+
+
+def created_for(index, dialect: str) -> bool:
+    # Индексы с ddl_if(dialect=...) create_all и миграции создают только на своей базе
+    condition = index._ddl_if
+    return condition is None or condition.dialect in (None, dialect)
+
+
+def check_schema(connection, tables):
+    missing = missing_schema(connection, tables)
+    if missing:
+        raise SchemaOutdated(
+            f"Схема базы {connection.engine.url!r} отстаёт от моделей, не хватает: {', '.join(missing)}. "
+            f"Примените миграции: python apply_migration.py"
+        )
+
+
+def ensure_schema(engine=None) -> str:
+    """Создаёт недостающие таблицы и индексы, если модели изменились.
+
+    Возвращает, что было сделано: "alembic", "current" или "created".
+    Если в существующих таблицах не хватает колонок или индексов,
+    бросает SchemaOutdated и не записывает версию.
+    """
+    engine = engine or database.engine
+    # Таблицы свайпов в шардах: checkfirst дешёвый, а новый шард мог появиться в любой момент
+    sharding.create_tables()
+    for shard_engine in sharding.router.engines:
+        with shard_engine.connect() as connection:
+            check_schema(connection, sharding.SHARDED_TABLES)
+    with engine.connect() as connection:
+        if stored_version(connection) == SCHEMA_VERSION:
+            return "current"
+        # Alembic импортируем, только если база вообще ведётся миграциями
+        if sa.inspect(connection).has_table("alembic_version") and alembic_at_head(connection):
+            return "alembic"
+    for attempt in range(2):
+        try:
+            with engine.begin() as connection:
+                models.Base.metadata.create_all(bind=connection)
+                search.create_index(connection)
+                # create_all не добавляет колонки и индексы в существующие таблицы
+                check_schema(connection, models.Base.metadata.sorted_tables)
+                schema_version.create(connection, checkfirst=True)
+                connection.execute(schema_version.delete())
+                connection.execute(schema_version.insert().values(version=SCHEMA_VERSION))
+            return "created"
+        except exc.DatabaseError:
+            # Соседний воркер создавал таблицы одновременно с нами; со второй
+            # попытки checkfirst увидит их
+            if attempt:
+                raise
+
+
+def warm_sync():
+    db = database.SessionLocal()
+    try:
+        if ranker.enabled:
+            ranker.ensure_loaded(db)
+        users = db.query(models.User).order_by(models.User.id.desc()).limit(STARTUP_WARM_PROFILES)
+        for user in users:
+            profile_cache.put(user)
+    finally:
+        db.close()
+
+
+async def warm_pools():
+    engines = {database.engine, database.read_engine}
+    for engine in engines:
+        await run_in_threadpool(ping, engine)
+    if database.ASYNC_DB:
+        for engine in {database.async_engine, database.async_read_engine}:
+            async with engine.connect() as connection:
+                await connection.execute(sa.text("SELECT 1"))
+
+
+def ping(engine):
+    with engine.connect() as connection:
+        connection.execute(sa.text("SELECT 1"))
+
+
+async def start():
+    """Вызывается из lifespan до того, как воркер начнёт принимать запросы."""
+    started = time.perf_counter()
+    if DB_SCHEMA_CHECK:
+        result = await run_in_threadpool(ensure_schema)
+        timings["schema"] = time.perf_counter() - started
+        logger.info("Схема базы: %s за %.3f с", result, timings["schema"])
+    if STARTUP_WARMUP:
+        warmup_started = time.perf_counter()
+        await warm_pools()
+        await run_in_threadpool(warm_sync)
+        timings["warmup"] = time.perf_counter() - warmup_started
+    timings["ready"] = time.perf_counter() - IMPORT_STARTED
+    logger.info("Воркер готов через %.3f с после импорта", timings["ready"])
+
+
+def first_request_done():
+    if "first_request" not in timings:
+        timings["first_request"] = time.perf_counter() - IMPORT_STARTED
+        logger.info("Первый запрос обработан через %.3f с после импорта", timings["first_request"])
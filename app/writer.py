@@ -0,0 +1,138 @@
+"""Фоновая запись свайпов с групповым коммитом.
+
+Маршруты не коммитят лайки сами, а ставят их в очередь SwipeWriter и ждут
+результат. Единственный писатель собирает свайпы из всех запросов за
+SWIPE_BATCH_WINDOW_MS миллисекунд (или до SWIPE_GROUP_MAX_ROWS штук) и пишет их
+одной транзакцией, то есть одним fsync. SWIPE_GROUP_COMMIT=0 отключает
+очередь, и маршруты пишут напрямую, как раньше.
+
+Писатель работает вне запросов, поэтому SQL группы делится между
+запросами, которые её ждали, пропорционально числу их свайпов (metrics.share).
+"""
+import asyncio
+import contextvars
+import logging
+import os
+
+from app import crud, crud_async, database, metrics
+
+SWIPE_GROUP_COMMIT = os.getenv("SWIPE_GROUP_COMMIT", "1") != "0"
+SWIPE_BATCH_WINDOW_MS = float(os.getenv("SWIPE_BATCH_WINDOW_MS", "5"))
+# Сколько свайпов из разных запросов собирается в один коммит; лимит одного
+# запроса /api/profiles/swipes задаёт schemas.SWIPE_BATCH_MAX
+SWIPE_GROUP_MAX_ROWS = int(os.getenv("SWIPE_GROUP_MAX_ROWS", "500"))
+
+logger = logging.getLogger(__name__)
+
+
+class SwipeWriter:
+    def __init__(self, window_ms: float = SWIPE_BATCH_WINDOW_MS, max_rows: int = SWIPE_GROUP_MAX_ROWS):
+        self.window = window_ms / 1000
+        self.max_rows = max_rows
+        self._loop = None
+        self._queue = None
+        self._task = None
+
+    def _ensure_started(self):
+        # Писатель запускается лениво в текущем цикле событий и перезапускается,
+        # если цикл сменился (например, между тестовыми клиентами)
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            # Задача стартует в пустом контексте, чтобы не унаследовать контекстные
+            # переменные запроса, который её случайно запустил (метрики, логи)
+            self._task = contextvars.Context().run(loop.create_task, self._run())
+
+    async def submit(self, from_user_id: int, swipes):
+        """Ставит свайпы в очередь и возвращает результат crud.write_swipes после коммита."""
+        self._ensure_started()
+        future = self._loop.create_future()
+        # Статистика запроса: ей достанется доля SQL группового коммита
+        await self._queue.put((from_user_id, swipes, future, metrics.current_request.get()))
+        return await future
+
+    async def _collect(self):
+        # None в очереди — сигнал остановки от stop()
+        job = await self._queue.get()
+        if job is None:
+            return [], True
+        jobs = [job]
+        rows = len(job[1])
+        deadline = self._loop.time() + self.window
+        while rows < self.max_rows:
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                job = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if job is None:
+                return jobs, True
+            jobs.append(job)
+            rows += len(job[1])
+        return jobs, False
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            jobs, stopping = await self._collect()
+            if jobs:
+                await self._flush(jobs)
+
+    async def _flush(self, jobs):
+        work = metrics.RequestStats(capture=metrics.SLOW_REQUEST_MS > 0)
+        token = metrics.current_request.set(work)
+        try:
+            async with self._session() as db:
+                results = await crud_async.run(db, crud.apply_swipe_groups, [job[:2] for job in jobs])
+        except Exception:
+            # Группа откатилась целиком: пишем запросы по одному, чтобы ошибка
+            # досталась только тому, кто её вызвал
+            logger.exception("Group commit of %d swipe jobs failed, retrying one by one", len(jobs))
+            metrics.share(work, [(stats, len(swipes)) for _, swipes, _, stats in jobs])
+            for from_user_id, swipes, future, stats in jobs:
+                metrics.current_request.set(stats)
+                try:
+                    async with self._session() as db:
+                        result = await crud_async.apply_swipes(db, from_user_id, swipes)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+            return
+        finally:
+            metrics.current_request.reset(token)
+        # Доля SQL записывается до ответа: middleware читает статистику, когда запрос завершится
+        metrics.share(work, [(stats, len(swipes)) for _, swipes, _, stats in jobs])
+        for (_, _, future, _), result in zip(jobs, results):
+            if not future.done():
+                future.set_result(result)
+
+    def _session(self):
+        if database.ASYNC_DB:
+            return database.AsyncSessionLocal()
+        return _SyncSession()
+
+    async def stop(self):
+        # Дописываем то, что уже в очереди, и останавливаем писателя
+        if self._task is None or self._task.done() or self._loop is not asyncio.get_running_loop():
+            return
+        await self._queue.put(None)
+        await self._task
+
+
+class _SyncSession:
+    # Синхронная сессия в виде асинхронного контекстного менеджера для режима DB_ASYNC=0
+    async def __aenter__(self):
+        self.db = database.SessionLocal()
+        return self.db
+
+    async def __aexit__(self, *exc):
+        self.db.close()
+
+
+swipe_writer = SwipeWriter()
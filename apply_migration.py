@@ -1,6 +1,7 @@
 from alembic.config import Config
 from alembic import command
 import os
+from app.database import SQLALCHEMY_DATABASE_URL
 
 def apply_migration():
     # Получаем путь к директории с миграциями
@@ -9,7 +10,7 @@ def apply_migration():
     # Создаем конфигурацию Alembic
     alembic_cfg = Config()
     alembic_cfg.set_main_option('script_location', migrations_dir)
-    alembic_cfg.set_main_option('sqlalchemy.url', 'sqlite:///./app.db')
+    alembic_cfg.set_main_option('sqlalchemy.url', SQLALCHEMY_DATABASE_URL)
     
     # Применяем миграцию
     command.upgrade(alembic_cfg, 'head')
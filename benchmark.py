@@ -0,0 +1,333 @@
+"""Воспроизводимый нагрузочный бенчмарк API.
+
+Заполняет одноразовую SQLite-базу синтетическими пользователями, лайками,
+дизлайками и матчами, прогоняет маршруты app.main внутри процесса (без
+сети) смешанной нагрузкой и печатает JSON с пропускной способностью,
+p50/p95/p99 и числом SQL-запросов на каждый эндпоинт. Не нагружаются только
+поток событий /api/matches/{user_id}/stream и /metrics.
+
+SQL считает middleware метрик приложения, поэтому запросам свайпов
+достаётся и их доля группового коммита фонового писателя.
+
+Пример:
+    python benchmark.py --users 5000 --likes 50000 --concurrency 32 --output bench.json
+    DB_ASYNC=0 python benchmark.py   # тот же прогон на синхронных сессиях
+    python benchmark.py --shards 4   # свайпы в четырёх временных шардах
+
+DATABASE_URL, REPLICA_DATABASE_URL и SWIPE_SHARDS из окружения
+игнорируются: бенчмарк всегда работает с файлами во временном каталоге.
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from contextvars import ContextVar
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+REGIONS = ["Москва", "Санкт-Петербург", "Екатеринбург", "Казань", "Новосибирск", "Краснодар"]
+CARS = ["BMW M3", "BMW M5", "Audi RS6", "Mercedes C63", "Toyota Supra", "Nissan GT-R", "Lada Vesta", "Subaru WRX"]
+SEARCH_QUERIES = ["bmw", "audi rs6", "toyota", "скорость", "пользователь 1", "lada vesta"]
+SEED_CHUNK = 5000
+# Токен бота для подписи initData в POST /api/init
+BOT_TOKEN = "123456:BENCHMARK"
+
+# Счётчик SQL-запросов текущего HTTP-запроса (список из одного числа)
+current_sql = ContextVar("current_sql", default=None)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000, help="сколько пользователей создать")
+    parser.add_argument("--likes", type=int, default=20000, help="сколько лайков создать")
+    parser.add_argument("--dislikes", type=int, default=20000, help="сколько дизлайков создать")
+    parser.add_argument("--matches", type=int, default=2000, help="сколько матчей создать")
+    parser.add_argument("--concurrency", type=int, default=16, help="число одновременных виртуальных пользователей")
+    parser.add_argument("--iterations", type=int, default=20, help="сценариев на одного виртуального пользователя")
+    parser.add_argument("--swipes", type=int, default=10, help="свайпов в одном сценарии init -> next -> like")
+    parser.add_argument("--seed", type=int, default=42, help="seed генератора случайных чисел")
+    parser.add_argument("--output", help="куда записать JSON (по умолчанию stdout)")
+    parser.add_argument("--shards", type=int, default=0, help="число временных шардов свайпов (0 — без шардов)")
+    parser.add_argument("--keep-db", action="store_true", help="не удалять временную базу после прогона")
+    return parser.parse_args()
+
+
+def random_pairs(rng, user_count, count, exclude=()):
+    pairs = set()
+    limit = min(count, user_count * (user_count - 1) - len(exclude))
+    while len(pairs) < limit:
+        a, b = rng.randint(1, user_count), rng.randint(1, user_count)
+        if a != b and (a, b) not in exclude:
+            pairs.add((a, b))
+    return pairs
+
+
+def insert_chunked(conn, table, rows):
+    for i in range(0, len(rows), SEED_CHUNK):
+        conn.execute(table.insert(), rows[i:i + SEED_CHUNK])
+
+
+def seed(engine, models, sharding, args, rng):
+    users = [
+        {
+            "telegram_id": f"bench{i}",
+            "name": f"Пользователь {i}",
+            "age": rng.randint(18, 60),
+            "photo_url": f"https://example.com/{i}.jpg",
+            "car": rng.choice(CARS),
+            "region": rng.choice(REGIONS),
+            "about": "Люблю скорость " * rng.randint(1, 20),
+        }
+        for i in range(1, args.users + 1)
+    ]
+    likes = random_pairs(rng, args.users, args.likes)
+    dislikes = random_pairs(rng, args.users, args.dislikes, exclude=likes)
+    matches = {tuple(sorted(pair)) for pair in random_pairs(rng, args.users, args.matches)}
+    with engine.begin() as conn:
+        insert_chunked(conn, models.User.__table__, users)
+    # Свайпы — в шард автора, матчи — в шарды обоих участников (см. app/sharding.py);
+    # с шардами id строк выдаёт sharding.with_ids, и обе копии матча получают один id
+    like_rows = sharding.with_ids(models.Like.__table__, [{"from_user_id": a, "to_user_id": b} for a, b in likes])
+    dislike_rows = sharding.with_ids(models.Dislike.__table__, [{"from_user_id": a, "to_user_id": b} for a, b in dislikes])
+    match_rows = sharding.with_ids(models.Match.__table__, [{"user1_id": a, "user2_id": b} for a, b in matches])
+    shards = sharding.swipe_engines()
+    for shard, swipes in enumerate(shards):
+        with swipes.begin() as conn:
+            insert_chunked(conn, models.Like.__table__,
+                           [row for row in like_rows if row["from_user_id"] % len(shards) == shard])
+            insert_chunked(conn, models.Dislike.__table__,
+                           [row for row in dislike_rows if row["from_user_id"] % len(shards) == shard])
+            insert_chunked(conn, models.Match.__table__,
+                           [row for row in match_rows
+                            if shard in (row["user1_id"] % len(shards), row["user2_id"] % len(shards))])
+    return {"users": len(users), "likes": len(likes), "dislikes": len(dislikes), "matches": len(matches)}
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.sql = {}
+        self.errors = {}
+
+    async def call(self, client, label, method, url, **kwargs):
+        # counter пополняет middleware метрик (см. record_sql в main)
+        counter = [0]
+        token = current_sql.set(counter)
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_sql.reset(token)
+        self.latencies.setdefault(label, []).append(elapsed)
+        self.sql.setdefault(label, []).append(counter[0])
+        if response.status_code >= 400:
+            self.errors[label] = self.errors.get(label, 0) + 1
+        return response
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def swipe_session(client, rec, rng, args):
+    telegram_id = f"bench{rng.randint(1, args.users)}"
+    user = (await rec.call(client, "GET /api/init/{telegram_id}", "GET", f"/api/init/{telegram_id}")).json()
+    batch = []
+    for _ in range(args.swipes):
+        params = {"current_user_id": user["id"]}
+        if rng.random() < 0.2:
+            params.update(region=rng.choice(REGIONS), min_age=25, max_age=35)
+        data = (await rec.call(client, "GET /api/profiles/next", "GET", "/api/profiles/next", params=params)).json()
+        if "profile" not in data:
+            break
+        target = data["profile"]["id"]
+        roll = rng.random()
+        if roll < 0.4:
+            await rec.call(client, "POST /api/profiles/{user_id}/like", "POST", f"/api/profiles/{target}/like",
+                           params={"current_user_id": user["id"]})
+        elif roll < 0.8:
+            await rec.call(client, "POST /api/profiles/{user_id}/dislike", "POST", f"/api/profiles/{target}/dislike",
+                           params={"current_user_id": user["id"]})
+        else:
+            batch.append({"to_user_id": target, "action": rng.choice(["like", "dislike"])})
+    if batch:
+        await rec.call(client, "POST /api/profiles/swipes", "POST", "/api/profiles/swipes",
+                       params={"current_user_id": user["id"]}, json={"swipes": batch})
+
+
+def init_data(telegram_id: str) -> str:
+    """initData, подписанная так же, как это делает Telegram."""
+    fields = {"auth_date": str(int(time.time())), "user": json.dumps({"id": telegram_id, "first_name": "Bench"})}
+    data_check_string = "\n".join(f"{key}={value}" for key, value in sorted(fields.items()))
+    secret_key = hmac.new(b"WebAppData", BOT_TOKEN.encode(), hashlib.sha256).digest()
+    fields["hash"] = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+async def search_session(client, rec, rng, args):
+    # Вход по initData и поиск с сессионным токеном
+    telegram_id = f"bench{rng.randint(1, args.users)}"
+    data = (await rec.call(client, "POST /api/init", "POST", "/api/init",
+                           json={"init_data": init_data(telegram_id)})).json()
+    headers = {"Authorization": f"Bearer {data['token']}"}
+    offset = 0
+    for _ in range(2):
+        page = (await rec.call(client, "GET /api/profiles/search", "GET", "/api/profiles/search", headers=headers,
+                               params={"q": rng.choice(SEARCH_QUERIES), "offset": offset})).json()
+        offset = page.get("next_offset")
+        if offset is None:
+            break
+
+
+async def matches_session(client, rec, rng, args):
+    user_id = rng.randint(1, args.users)
+    after = 0
+    for _ in range(3):
+        data = (await rec.call(client, "GET /api/matches/{user_id}", "GET", f"/api/matches/{user_id}",
+                               params={"limit": 20, "after": after})).json()
+        after = data.get("next_after")
+        if after is None:
+            break
+
+
+async def profile_session(client, rec, rng, args):
+    user_id = rng.randint(1, args.users)
+    telegram_id = f"bench{user_id}"
+    await rec.call(client, "GET /api/users/{telegram_id}", "GET", f"/api/users/{telegram_id}")
+    if rng.random() < 0.3:
+        await rec.call(client, "PUT /api/users/{telegram_id}", "PUT", f"/api/users/{telegram_id}",
+                       json={"age": rng.randint(18, 60), "car": rng.choice(CARS), "region": rng.choice(REGIONS)})
+    if rng.random() < 0.2:
+        await rec.call(client, "PUT /api/profiles/about", "PUT", "/api/profiles/about",
+                       json={"user_id": user_id, "about": "Обновлённое описание"})
+    if rng.random() < 0.05:
+        await rec.call(client, "GET /", "GET", "/")
+        await rec.call(client, "GET /api/generate-password", "GET", "/api/generate-password")
+
+
+SCENARIOS = [(swipe_session, 0.6), (matches_session, 0.15), (profile_session, 0.15), (search_session, 0.1)]
+
+
+async def virtual_user(client, rec, rng, args):
+    functions, weights = zip(*SCENARIOS)
+    for _ in range(args.iterations):
+        await rng.choices(functions, weights)[0](client, rec, rng, args)
+
+
+async def drive(app, rec, args):
+    import httpx
+
+    # ASGITransport не запускает lifespan: проходим его сами, как сервер, чтобы
+    # на выходе писатель свайпов дописал очередь
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            start = time.perf_counter()
+            await asyncio.gather(*[
+                virtual_user(client, rec, random.Random(args.seed + i), args)
+                for i in range(args.concurrency)
+            ])
+            elapsed = time.perf_counter() - start
+    return elapsed
+
+
+def report(rec, elapsed, seeded, args, background_sql):
+    endpoints = {}
+    for label in sorted(rec.latencies):
+        latencies = rec.latencies[label]
+        endpoints[label] = {
+            "count": len(latencies),
+            "errors": rec.errors.get(label, 0),
+            "rps": round(len(latencies) / elapsed, 1),
+            "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+            "sql_per_request": round(sum(rec.sql[label]) / len(latencies), 2),
+        }
+    total = sum(len(v) for v in rec.latencies.values())
+    return {
+        "config": {
+            "concurrency": args.concurrency,
+            "iterations": args.iterations,
+            "swipes": args.swipes,
+            "seed": args.seed,
+            "shards": args.shards,
+            "db_async": os.getenv("DB_ASYNC", "1") != "0",
+            "swipe_group_commit": os.getenv("SWIPE_GROUP_COMMIT", "1") != "0",
+        },
+        "seeded": seeded,
+        "total": {"requests": total, "seconds": round(elapsed, 3), "rps": round(total / elapsed, 1)},
+        "endpoints": endpoints,
+        # SQL вне HTTP-запросов (фоновые задачи); групповой коммит свайпов
+        # уже разделён между запросами, которые его ждали
+        "background_sql": background_sql,
+    }
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+
+    cwd = os.getcwd()
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = tempfile.mkdtemp(prefix="tg-bd-bench-")
+    os.chdir(workdir)
+    # URL баз читаются при импорте app, поэтому до него направляем их во
+    # временный каталог: настоящая база из окружения не должна попасть под нагрузку
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'test.db')}"
+    os.environ.pop("REPLICA_DATABASE_URL", None)
+    os.environ["SWIPE_SHARDS"] = ",".join(
+        f"sqlite:///{os.path.join(workdir, f'swipes{shard}.db')}" for shard in range(args.shards)
+    )
+    os.environ["TELEGRAM_BOT_TOKEN"] = BOT_TOKEN
+    sys.path.insert(0, ROOT)
+    from app import database, metrics, models, sharding, startup
+    from app.main import app
+
+    # Схема нужна до заполнения базы, lifespan запустится позже, в drive()
+    startup.ensure_schema()
+    seeded = seed(database.engine, models, sharding, args, rng)
+
+    # Middleware метрик зовёт finish в задаче запроса, где Recorder.call
+    # выставил счётчик; статистика запроса уже включает долю группового коммита
+    finish = metrics.registry.finish
+
+    def record_sql(method, route, status, seconds, stats):
+        counter = current_sql.get()
+        if counter is not None:
+            counter[0] += stats.statements
+        finish(method, route, status, seconds, stats)
+
+    metrics.registry.finish = record_sql
+    background_before = metrics.registry.sql.get(metrics.BACKGROUND_ROUTE, [0])[0]
+
+    rec = Recorder()
+    try:
+        elapsed = asyncio.run(drive(app, rec, args))
+        background_sql = metrics.registry.sql.get(metrics.BACKGROUND_ROUTE, [0])[0] - background_before
+    finally:
+        os.chdir(cwd)
+        if not args.keep_db:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    result = json.dumps(report(rec, elapsed, seeded, args, background_sql), ensure_ascii=False, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(result + "\n")
+    else:
+        print(result)
+
+
+if __name__ == "__main__":
+    main()
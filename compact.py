@@ -0,0 +1,41 @@
+"""Очистка старых свайпов (см. app/retention.py) с отчётом в JSON.
+
+Подходит для запуска из cron:
+    python compact.py
+    python compact.py --dislike-days 14 --like-days 60 --batch 1000
+"""
+import argparse
+import json
+
+from sqlalchemy import create_engine
+
+from app import retention
+from app.database import configure_sqlite
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="URL базы со свайпами (по умолчанию основная база или все шарды SWIPE_SHARDS)")
+    parser.add_argument("--dislike-days", type=float, default=retention.DISLIKE_RETENTION_DAYS,
+                        help="удалять дизлайки старше N дней")
+    parser.add_argument("--like-days", type=float, default=retention.LIKE_RETENTION_DAYS,
+                        help="архивировать невзаимные лайки старше N дней")
+    parser.add_argument("--batch", type=int, default=retention.RETENTION_BATCH, help="строк в одной транзакции")
+    parser.add_argument("--pause-ms", type=float, default=retention.RETENTION_PAUSE_MS,
+                        help="пауза между пачками, чтобы не мешать записи свайпов")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    engine = None
+    if args.url:
+        engine = create_engine(args.url)
+        # WAL и busy_timeout, как у приложения: очистка ждёт блокировку, а не падает
+        configure_sqlite(engine)
+    report = retention.compact(engine, args.dislike_days, args.like_days, args.batch, args.pause_ms / 1000)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
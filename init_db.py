@@ -1,9 +1,9 @@
-from app.database import Base, engine
-from app.models import *  # Импортируем все модели
+from app.startup import ensure_schema
 
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    # Та же проверка, что выполняет воркер при старте: create_all только при изменении моделей
+    return ensure_schema()
 
 if __name__ == "__main__":
-    init_db()
-    print("База данных успешно инициализирована!") 
\ No newline at end of file
+    result = init_db()
+    print(f"База данных успешно инициализирована! ({result})")
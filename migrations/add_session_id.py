@@ -3,30 +3,38 @@ import sqlalchemy as sa
 import random
 import string
 
+from migrations.backfill import backfill
+
+def generate_id():
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=10))
+
 def upgrade():
-    # Добавляем колонку session_id
-    op.add_column('users', sa.Column('session_id', sa.String(), nullable=True))
+    # Добавляем колонку session_id; проверка нужна, чтобы прерванную миграцию
+    # можно было запустить повторно и продолжить заполнение
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('users')}
+    if 'session_id' not in columns:
+        op.add_column('users', sa.Column('session_id', sa.String(), nullable=True))
     
-    # Создаем индекс для session_id
-    op.create_index('ix_users_session_id', 'users', ['session_id'], unique=True)
+    # Генерируем случайные ID для существующих пользователей пачками,
+    # пропуская уже заполненные строки
+    backfill(
+        'users.session_id',
+        'users',
+        "UPDATE users SET session_id = :value WHERE id = :id AND session_id IS NULL",
+        values=lambda user_id: {'value': generate_id()},
+    )
     
-    # Генерируем случайные ID для существующих пользователей
-    connection = op.get_bind()
-    users = connection.execute("SELECT id FROM users").fetchall()
-    
-    for user in users:
-        session_id = ''.join(random.choices(string.ascii_letters + string.digits, k=10))
-        connection.execute(
-            "UPDATE users SET session_id = %s WHERE id = %s",
-            (session_id, user[0])
-        )
+    # Создаем индекс для session_id один раз по заполненной колонке
+    op.create_index('ix_users_session_id', 'users', ['session_id'], unique=True)
     
     # Делаем колонку обязательной после заполнения
-    op.alter_column('users', 'session_id', nullable=False)
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.alter_column('session_id', existing_type=sa.String(), nullable=False)
 
 def downgrade():
     # Удаляем индекс
     op.drop_index('ix_users_session_id', table_name='users')
     
     # Удаляем колонку
-    op.drop_column('users', 'session_id') 
\ No newline at end of file
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('session_id')
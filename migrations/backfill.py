@@ -0,0 +1,72 @@
+"""Пакетное заполнение данных в миграциях Alembic.
+
+backfill() обходит таблицу по первичному ключу пачками, обновляет каждую
+пачку отдельной короткой транзакцией и после каждой пачки записывает
+контрольную точку. Блокировка на запись держится только на время одной
+пачки, в памяти лежат только её id, а прерванная миграция при повторном
+запуске продолжает с последней закоммиченной пачки.
+"""
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+from alembic import op
+
+CHECKPOINT_TABLE = 'backfill_checkpoints'
+
+checkpoints = sa.Table(
+    CHECKPOINT_TABLE, sa.MetaData(),
+    sa.Column('name', sa.String, primary_key=True),
+    sa.Column('last_id', sa.Integer, nullable=False),
+)
+
+
+@contextmanager
+def chunk_transaction(connection):
+    # Соединение в режиме AUTOCOMMIT, поэтому границы транзакции ставим сами
+    connection.exec_driver_sql('BEGIN')
+    try:
+        yield
+    except Exception:
+        connection.exec_driver_sql('ROLLBACK')
+        raise
+    connection.exec_driver_sql('COMMIT')
+
+
+def backfill(name, table, statement, values=None, chunk_size=1000, key='id'):
+    """Выполняет statement для всех строк table пачками по chunk_size.
+
+    Без values statement выполняется один раз на пачку как set-based UPDATE
+    с параметрами :lower и :upper (id > :lower AND id <= :upper). С values
+    statement выполняется через executemany: values(id) возвращает словарь
+    параметров для строки, параметр :id добавляется автоматически.
+
+    name — имя контрольной точки; после успешного завершения она удаляется.
+    Коммит идёт после каждой пачки, поэтому транзакция миграции перед вызовом
+    фиксируется (см. MigrationContext.autocommit_block).
+    """
+    statement = sa.text(statement) if isinstance(statement, str) else statement
+    pk = sa.column(key)
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        checkpoints.create(connection, checkfirst=True)
+        last_id = connection.execute(
+            sa.select(checkpoints.c.last_id).where(checkpoints.c.name == name)
+        ).scalar() or 0
+
+        while True:
+            ids = connection.execute(
+                sa.select(pk).select_from(sa.table(table)).where(pk > last_id).order_by(pk).limit(chunk_size)
+            ).scalars().all()
+            if not ids:
+                break
+            with chunk_transaction(connection):
+                if values is None:
+                    connection.execute(statement, {'lower': last_id, 'upper': ids[-1]})
+                else:
+                    connection.execute(statement, [{**values(row_id), 'id': row_id} for row_id in ids])
+                last_id = ids[-1]
+                connection.execute(checkpoints.delete().where(checkpoints.c.name == name))
+                connection.execute(checkpoints.insert().values(name=name, last_id=last_id))
+
+        with chunk_transaction(connection):
+            connection.execute(checkpoints.delete().where(checkpoints.c.name == name))
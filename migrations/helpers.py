@@ -0,0 +1,25 @@
+"""Проверки схемы для миграций.
+
+База могла быть создана через create_all (app/startup.py) до того, как её
+начали вести миграциями, поэтому ревизии пропускают уже существующие
+таблицы, колонки и индексы и их можно применять к такой базе.
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+def has_table(table):
+    return sa.inspect(op.get_bind()).has_table(table)
+
+
+def has_column(table, column):
+    return column in {c['name'] for c in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def has_index(table, name):
+    return name in {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def create_index(name, table, columns, **kw):
+    if not has_index(table, name):
+        op.create_index(name, table, columns, **kw)
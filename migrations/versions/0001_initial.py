@@ -0,0 +1,53 @@
+"""Исходные таблицы users, likes, dislikes, matches
+
+Revision ID: 0001
+Revises:
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import has_table
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def swipe_columns():
+    return (
+        sa.Column('id', sa.Integer(), primary_key=True, index=True),
+        sa.Column('from_user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('to_user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+    )
+
+
+def upgrade():
+    # Базы, созданные до Alembic, уже содержат эти таблицы
+    if not has_table('users'):
+        op.create_table(
+            'users',
+            sa.Column('id', sa.Integer(), primary_key=True, index=True),
+            sa.Column('telegram_id', sa.String(), unique=True, nullable=False),
+            sa.Column('name', sa.String(), nullable=False),
+            sa.Column('age', sa.Integer(), nullable=False),
+            sa.Column('photo_url', sa.String(), nullable=True),
+            sa.Column('car', sa.String(), nullable=False),
+            sa.Column('region', sa.String(), nullable=False),
+            sa.Column('about', sa.String(), nullable=True),
+        )
+    for table in ('likes', 'dislikes'):
+        if not has_table(table):
+            op.create_table(table, *swipe_columns())
+    if not has_table('matches'):
+        op.create_table(
+            'matches',
+            sa.Column('id', sa.Integer(), primary_key=True, index=True),
+            sa.Column('user1_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+            sa.Column('user2_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        )
+
+
+def downgrade():
+    for table in ('matches', 'dislikes', 'likes', 'users'):
+        op.drop_table(table)
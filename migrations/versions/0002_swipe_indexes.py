@@ -0,0 +1,31 @@
+"""Уникальные и обратные индексы свайпов
+
+Revision ID: 0002
+Revises: 0001
+"""
+from alembic import op
+
+from migrations.helpers import create_index
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+SWIPE_TABLES = ('likes', 'dislikes')
+
+def upgrade():
+    for table in SWIPE_TABLES:
+        # Перед уникальным индексом убираем дубликаты от повторных запросов,
+        # оставляя самую раннюю запись для каждой пары
+        op.execute(
+            f"DELETE FROM {table} WHERE id NOT IN "
+            f"(SELECT MIN(id) FROM {table} GROUP BY from_user_id, to_user_id)"
+        )
+        create_index(f'ux_{table}_from_to', table, ['from_user_id', 'to_user_id'], unique=True)
+        create_index(f'ix_{table}_to_from', table, ['to_user_id', 'from_user_id'])
+
+def downgrade():
+    for table in SWIPE_TABLES:
+        op.drop_index(f'ix_{table}_to_from', table_name=table)
+        op.drop_index(f'ux_{table}_from_to', table_name=table)
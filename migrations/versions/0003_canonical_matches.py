@@ -0,0 +1,34 @@
+"""Канонические пары матчей user1_id < user2_id
+
+Revision ID: 0003
+Revises: 0002
+"""
+from alembic import op
+
+from migrations.helpers import create_index
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Приводим пары к виду user1_id < user2_id
+    op.execute(
+        "UPDATE matches SET "
+        "user1_id = CASE WHEN user1_id < user2_id THEN user1_id ELSE user2_id END, "
+        "user2_id = CASE WHEN user1_id < user2_id THEN user2_id ELSE user1_id END"
+    )
+
+    # Удаляем дубликаты, оставляя самый ранний матч для каждой пары
+    op.execute(
+        "DELETE FROM matches WHERE id NOT IN "
+        "(SELECT MIN(id) FROM matches GROUP BY user1_id, user2_id)"
+    )
+
+    create_index('ux_matches_user1_user2', 'matches', ['user1_id', 'user2_id'], unique=True)
+    create_index('ix_matches_user2_user1', 'matches', ['user2_id', 'user1_id'])
+
+def downgrade():
+    op.drop_index('ix_matches_user2_user1', table_name='matches')
+    op.drop_index('ux_matches_user1_user2', table_name='matches')
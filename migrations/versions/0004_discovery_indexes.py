@@ -0,0 +1,24 @@
+"""Индексы под фильтры /api/profiles/next
+
+Revision ID: 0004
+Revises: 0003
+"""
+from alembic import op
+
+from migrations.helpers import create_index
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Индексы под фильтры регион/возраст/машина в /api/profiles/next
+    create_index('ix_users_region_age', 'users', ['region', 'age'])
+    create_index('ix_users_age', 'users', ['age'])
+    create_index('ix_users_car', 'users', ['car'])
+
+def downgrade():
+    op.drop_index('ix_users_car', table_name='users')
+    op.drop_index('ix_users_age', table_name='users')
+    op.drop_index('ix_users_region_age', table_name='users')
@@ -0,0 +1,51 @@
+"""Время свайпов и архив старых лайков
+
+Revision ID: 0005
+Revises: 0004
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.backfill import backfill
+from migrations.helpers import create_index, has_column, has_table
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+SWIPE_TABLES = ('likes', 'dislikes')
+
+def upgrade():
+    for table in SWIPE_TABLES:
+        # Колонку добавляем без значения по умолчанию: SQLite не умеет
+        # ALTER TABLE ADD COLUMN с DEFAULT CURRENT_TIMESTAMP
+        if not has_column(table, 'created_at'):
+            op.add_column(table, sa.Column('created_at', sa.DateTime(), nullable=True))
+
+        # Время старых свайпов неизвестно: считаем их сделанными в момент миграции,
+        # чтобы очистка не удалила всё сразу
+        backfill(
+            f'{table}.created_at',
+            table,
+            f"UPDATE {table} SET created_at = CURRENT_TIMESTAMP "
+            f"WHERE id > :lower AND id <= :upper AND created_at IS NULL",
+        )
+        create_index(f'ix_{table}_created_at', table, ['created_at'])
+
+    if not has_table('likes_archive'):
+        op.create_table(
+            'likes_archive',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('from_user_id', sa.Integer(), nullable=False),
+            sa.Column('to_user_id', sa.Integer(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('archived_at', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        )
+
+def downgrade():
+    op.drop_table('likes_archive')
+    for table in SWIPE_TABLES:
+        op.drop_index(f'ix_{table}_created_at', table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('created_at')
@@ -0,0 +1,23 @@
+"""Полнотекстовый поиск анкет (FTS5)
+
+Revision ID: 0006
+Revises: 0005
+"""
+from alembic import op
+from sqlalchemy import text
+
+from app import search
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Индекс FTS5 и триггеры синхронизации; существующие анкеты индексируются сразу
+    search.create_index(op.get_bind())
+
+def downgrade():
+    for trigger in ('users_fts_insert', 'users_fts_delete', 'users_fts_update'):
+        op.execute(text(f'DROP TRIGGER IF EXISTS {trigger}'))
+    op.execute(text(f'DROP TABLE IF EXISTS {search.FTS_TABLE}'))
@@ -0,0 +1,25 @@
+"""Счётчики глобальных id для шардов свайпов
+
+Revision ID: 0007
+Revises: 0006
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import has_table
+
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    if not has_table('id_sequences'):
+        op.create_table(
+            'id_sequences',
+            sa.Column('name', sa.String(), primary_key=True),
+            sa.Column('next_id', sa.Integer(), nullable=False),
+        )
+
+def downgrade():
+    op.drop_table('id_sequences')
@@ -0,0 +1,21 @@
+"""Индекс архива лайков для просмотренных анкет
+
+Revision ID: 0008
+Revises: 0007
+"""
+from alembic import op
+
+from migrations.helpers import create_index
+
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Заархивированные лайки остаются просмотренными: индекс seen и поиск
+    # выбирают их по from_user_id
+    create_index('ix_likes_archive_from_to', 'likes_archive', ['from_user_id', 'to_user_id'])
+
+def downgrade():
+    op.drop_index('ix_likes_archive_from_to', table_name='likes_archive')
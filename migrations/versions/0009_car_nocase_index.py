@@ -0,0 +1,26 @@
+"""Фильтр по машине без учёта регистра
+
+Revision ID: 0009
+Revises: 0008
+"""
+from alembic import op
+from sqlalchemy import text
+
+from migrations.helpers import create_index, has_index
+
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Диапазон по car сравнивается в NOCASE, бинарный индекс ему не подходит
+    if op.get_bind().dialect.name == 'sqlite':
+        create_index('ix_users_car_nocase', 'users', [text('car COLLATE NOCASE')])
+    if has_index('users', 'ix_users_car'):
+        op.drop_index('ix_users_car', table_name='users')
+
+def downgrade():
+    create_index('ix_users_car', 'users', ['car'])
+    if has_index('users', 'ix_users_car_nocase'):
+        op.drop_index('ix_users_car_nocase', table_name='users')
@@ -0,0 +1,103 @@
+"""Перекладывает свайпы и матчи по шардам (см. app/sharding.py).
+
+Строки читаются из баз-источников пачками по id и пишутся в шард, который
+им положен при новом числе шардов: лайки, дизлайки и архив — в шард
+from_user_id, матчи — в шарды обоих участников. id строк сохраняются (они
+глобальные, см. app.sharding.IdAllocator). Вставка пропускает строки, уже
+перенесённые по id или по паре пользователей, поэтому прерванный перенос
+можно просто запустить снова. В конце счётчики id_sequences ставятся за
+максимальный перенесённый id.
+С --delete перенесённые строки удаляются из источника после коммита пачки.
+
+Запускайте при остановленной записи свайпов, затем перезапустите приложение
+с новым SWIPE_SHARDS.
+
+Примеры:
+    # из одной базы в два шарда
+    SWIPE_SHARDS=sqlite:///./swipes0.db,sqlite:///./swipes1.db python rebalance.py --delete
+    # с двух шардов на три
+    python rebalance.py --source sqlite:///./swipes0.db sqlite:///./swipes1.db \\
+        --shards sqlite:///./swipes0.db sqlite:///./swipes1.db sqlite:///./swipes2.db --delete
+"""
+import argparse
+import sys
+import time
+
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+
+from app import database, models, sharding
+from app.database import SQLALCHEMY_DATABASE_URL, SWIPE_SHARD_URLS, make_engine
+
+TABLES = {table.name: table for table in sharding.SHARDED_TABLES}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", nargs="+", default=[SQLALCHEMY_DATABASE_URL], help="базы, откуда читать свайпы")
+    parser.add_argument("--shards", nargs="+", default=SWIPE_SHARD_URLS, help="новый список шардов (по умолчанию SWIPE_SHARDS)")
+    parser.add_argument("--chunk", type=int, default=5000, help="строк в одной пачке")
+    parser.add_argument("--delete", action="store_true", help="удалять перенесённые строки из источника")
+    return parser.parse_args()
+
+
+def targets(table_name, row, shard_count):
+    return {row._mapping[key] % shard_count for key in sharding.SHARD_KEYS[table_name]}
+
+
+def move_table(source_url, source, shards, shard_urls, table_name, chunk, delete):
+    table = TABLES[table_name]
+    columns = list(table.columns)
+    # Без цели: пропускаем и совпавший id, и совпавшую пару пользователей
+    statement = insert(table).on_conflict_do_nothing()
+    moved, last_id = 0, 0
+    while True:
+        with source.connect() as connection:
+            rows = connection.execute(
+                select(table).where(table.c.id > last_id).order_by(table.c.id).limit(chunk)
+            ).all()
+        if not rows:
+            return moved
+        last_id = rows[-1].id
+
+        by_shard, done = {}, []
+        for row in rows:
+            shard_ids = targets(table_name, row, len(shards))
+            # Строка уже лежит в своём шарде
+            stays = any(shard_urls[shard] == source_url for shard in shard_ids)
+            for shard in shard_ids:
+                if shard_urls[shard] != source_url:
+                    by_shard.setdefault(shard, []).append({column.name: row._mapping[column.name] for column in columns})
+            if not stays:
+                done.append(row.id)
+        for shard, values in by_shard.items():
+            with shards[shard].begin() as connection:
+                connection.execute(statement, values)
+        if delete and done:
+            with source.begin() as connection:
+                connection.execute(table.delete().where(table.c.id.in_(done)))
+        moved += sum(len(values) for values in by_shard.values())
+
+
+def main():
+    args = parse_args()
+    if not args.shards:
+        sys.exit("Не задан список шардов: --shards или SWIPE_SHARDS")
+    shards = [make_engine(url) for url in args.shards]
+    for engine in shards:
+        models.Base.metadata.create_all(bind=engine, tables=list(TABLES.values()))
+
+    for source_url in args.source:
+        source = make_engine(source_url)
+        for table_name in TABLES:
+            start = time.perf_counter()
+            moved = move_table(source_url, source, shards, args.shards, table_name, args.chunk, args.delete)
+            print(f"{source_url} {table_name}: {moved} строк за {time.perf_counter() - start:.1f} с", file=sys.stderr)
+    # Счётчики живут в основной базе, даже если свайпы из неё уже перенесены
+    models.IdSequence.__table__.create(database.engine, checkfirst=True)
+    for table_name in TABLES:
+        sharding.id_allocator.sync(table_name, shards)
+
+
+if __name__ == "__main__":
+    main()
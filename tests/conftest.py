@@ -0,0 +1,65 @@
+"""Общие фикстуры: временная база и шарды свайпов вместо test.db из рабочего каталога."""
+import os
+import tempfile
+
+import pytest
+
+# URL баз читаются при импорте app, поэтому задаём их до импорта модулей с тестами
+DATA_DIR = tempfile.mkdtemp(prefix="tg-bd-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(DATA_DIR, 'test.db')}"
+os.environ.pop("REPLICA_DATABASE_URL", None)
+os.environ["SWIPE_SHARDS"] = ""
+
+from app import database, models, sharding  # noqa: E402
+from app.cache import profile_cache  # noqa: E402
+from app.ranking import ranker  # noqa: E402
+from app.seen import seen_index  # noqa: E402
+
+
+def reset_memory():
+    # Индексы и кэши живут в процессе и пережили бы пересоздание базы
+    seen_index.invalidate()
+    profile_cache.invalidate()
+    ranker.features = None
+    ranker._pending = None
+    ranker._queues.clear()
+    sharding.id_allocator._blocks.clear()
+
+
+@pytest.fixture
+def engine():
+    models.Base.metadata.create_all(bind=database.engine)
+    reset_memory()
+    yield database.engine
+    models.Base.metadata.drop_all(bind=database.engine)
+    reset_memory()
+
+
+@pytest.fixture
+def db(engine):
+    session = database.SessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def shards(engine, monkeypatch, tmp_path):
+    """Включает два шарда свайпов во временном каталоге."""
+    router = sharding.ShardRouter([f"sqlite:///{tmp_path / f'swipes{shard}.db'}" for shard in range(2)])
+    monkeypatch.setattr(sharding, "router", router)
+    sharding.create_tables()
+    yield router
+    for shard_engine in router.engines:
+        shard_engine.dispose()
+
+
+@pytest.fixture
+def users(db):
+    """Создаёт пользователей и возвращает их id."""
+    def create(count):
+        rows = [models.User(telegram_id=f"user{i}", name=f"User {i}", age=30, car="BMW M3", region="Москва")
+                for i in range(count)]
+        db.add_all(rows)
+        db.commit()
+        return [row.id for row in rows]
+    return create
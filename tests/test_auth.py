@@ -0,0 +1,69 @@
+"""Проверка подписи initData и сессионных токенов (app.auth)."""
+import hashlib
+import hmac
+import json
+import time
+from urllib.parse import urlencode
+
+import pytest
+from fastapi import HTTPException
+from jose import jwt
+
+from app import auth
+
+BOT_TOKEN = "123456:TEST"
+
+
+def init_data(user_id=777, auth_date=None, bot_token=BOT_TOKEN, **extra):
+    """initData, подписанная так же, как это делает Telegram."""
+    fields = {
+        "auth_date": str(int(time.time()) if auth_date is None else auth_date),
+        "query_id": "AAHdF6IQAAAAAN0XohDhrOrc",
+        "user": json.dumps({"id": user_id, "first_name": "Ivan"}),
+        **extra,
+    }
+    data_check_string = "\n".join(f"{key}={value}" for key, value in sorted(fields.items()))
+    secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    fields["hash"] = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+def assert_unauthorized(call, *args, **kwargs):
+    with pytest.raises(HTTPException) as error:
+        call(*args, **kwargs)
+    assert error.value.status_code == 401
+
+
+def test_valid_init_data():
+    user = auth.validate_init_data(init_data(user_id=777), bot_token=BOT_TOKEN)
+    assert user["id"] == 777
+
+
+def test_tampered_init_data():
+    data = init_data(user_id=777).replace("777", "778")
+    assert_unauthorized(auth.validate_init_data, data, bot_token=BOT_TOKEN)
+
+
+def test_init_data_signed_by_other_bot():
+    assert_unauthorized(auth.validate_init_data, init_data(bot_token="654321:OTHER"), bot_token=BOT_TOKEN)
+
+
+def test_expired_init_data():
+    data = init_data(auth_date=int(time.time()) - 2 * 3600)
+    assert_unauthorized(auth.validate_init_data, data, bot_token=BOT_TOKEN, max_age=3600)
+
+
+def test_valid_token():
+    token = auth.issue_token(42, "777")
+    assert auth.decode_token(token) == auth.Identity(user_id=42, telegram_id="777")
+
+
+def test_expired_token():
+    assert_unauthorized(auth.decode_token, auth.issue_token(42, "777", ttl=-10))
+
+
+def test_forged_token():
+    now = int(time.time())
+    claims = {"sub": "42", "tg": "777", "iat": now, "exp": now + 3600}
+    token = jwt.encode(claims, "not-the-session-secret", algorithm=auth.ALGORITHM)
+    assert_unauthorized(auth.decode_token, token)
@@ -0,0 +1,72 @@
+"""Выдача анкет с фильтрами (app.crud.get_next_profile)."""
+import pytest
+from sqlalchemy import event, text
+
+from app import crud, database, models, ranking
+
+REGIONS = ["Москва", "Казань", "Пермь"]
+CARS = ["BMW M3", "Audi A4", "Lada Vesta"]
+
+
+@pytest.fixture
+def crowd(db, monkeypatch):
+    # Ранжирование выключено: проверяем обход по индексу
+    monkeypatch.setattr(ranking, "RANKED_DISCOVERY", False)
+    db.add_all([
+        models.User(telegram_id=f"user{i}", name=f"User {i}", age=18 + i % 50,
+                    region=REGIONS[i % len(REGIONS)], car=CARS[i % len(CARS)])
+        for i in range(3000)
+    ])
+    db.commit()
+    db.execute(text("ANALYZE"))
+    db.commit()
+    return db.query(models.User).order_by(models.User.id).first()
+
+
+def scan_plans(db, **filters):
+    """Планы запросов обхода, выполненных при выдаче одной анкеты."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if "ORDER BY" in statement:
+            statements.append((statement, parameters))
+
+    event.listen(database.engine, "before_cursor_execute", record)
+    try:
+        crud.get_next_profile(db, 1, **filters)
+    finally:
+        event.remove(database.engine, "before_cursor_execute", record)
+    assert statements
+    return [
+        " ".join(row[-1] for row in db.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters))
+        for statement, parameters in statements
+    ]
+
+
+@pytest.mark.parametrize("filters, index", [
+    ({"region": "Казань", "min_age": 20, "max_age": 30}, "ix_users_region_age"),
+    ({"region": "Казань"}, "ix_users_region_age"),
+    ({"min_age": 20, "max_age": 30}, "ix_users_age"),
+    ({"car": "audi"}, "ix_users_car_nocase"),
+    ({"car": "audi", "region": "Казань"}, "ix_users_car_nocase"),
+])
+def test_filtered_scan_uses_index(crowd, db, filters, index):
+    for plan in scan_plans(db, **filters):
+        assert f"INDEX {index}" in plan, plan
+        assert "SCAN users" not in plan and "TEMP B-TREE" not in plan, plan
+
+
+def test_filtered_discovery_exhausts_matching_profiles(crowd, db):
+    filters = {"region": "Пермь", "min_age": 20, "max_age": 25, "car": "lada"}
+    expected = {
+        user.id for user in db.query(models.User).filter(
+            models.User.region == "Пермь", models.User.age.between(20, 25), models.User.car == "Lada Vesta"
+        )
+    }
+    assert expected
+    shown = set()
+    while (user := crud.get_next_profile(db, crowd.id, **filters)) is not None:
+        assert user.id not in shown
+        shown.add(user.id)
+        crud.dislike_user(db, crowd.id, user.id)
+    assert shown == expected - {crowd.id}
@@ -0,0 +1,30 @@
+"""Метрики SQL по маршрутам (app.metrics)."""
+import re
+
+from fastapi.testclient import TestClient
+
+from app import metrics
+from app.main import app
+
+
+def statements(text, route):
+    found = re.search(rf'^db_statements_total{{route="{re.escape(route)}"}} (\d+)$', text, re.M)
+    return int(found.group(1)) if found else 0
+
+
+def test_group_commit_sql_is_charged_to_swipe_routes(engine, users):
+    me, other, third = users(3)
+    like_route = "/api/profiles/{user_id}/like"
+    batch_route = "/api/profiles/swipes"
+    with TestClient(app) as client:
+        before = client.get("/metrics").text
+        background = metrics.registry.sql.get(metrics.BACKGROUND_ROUTE, [0])[0]
+        assert client.post(f"/api/profiles/{other}/like", params={"current_user_id": me}).status_code == 200
+        response = client.post(batch_route, params={"current_user_id": me},
+                               json={"swipes": [{"to_user_id": third, "action": "dislike"}]})
+        assert response.status_code == 200
+        after = client.get("/metrics").text
+
+    assert statements(after, like_route) > statements(before, like_route)
+    assert statements(after, batch_route) > statements(before, batch_route)
+    assert metrics.registry.sql.get(metrics.BACKGROUND_ROUTE, [0])[0] == background
@@ -0,0 +1,43 @@
+"""Перечитывание матрицы признаков ранжирования (app.ranking)."""
+import threading
+
+import pytest
+
+from app import ranking
+from app.ranking import ranker
+
+pytestmark = pytest.mark.skipif(ranking.np is None, reason="ранжирование требует numpy")
+
+
+def test_stale_reload_runs_in_background(db, users, monkeypatch):
+    monkeypatch.setattr(ranking, "RANKED_DISCOVERY", True)
+    first, second = users(2)
+    ranker.ensure_loaded(db)
+    old = ranker.features
+
+    started, release = threading.Event(), threading.Event()
+    reload = ranker.reload
+
+    def slow_reload(session):
+        started.set()
+        release.wait(5)
+        reload(session)
+
+    monkeypatch.setattr(ranker, "reload", slow_reload)
+    ranker.loaded_at = 0.0
+    # Запрос не ждёт перечитывания и ранжирует по старой матрице
+    ranker.ensure_loaded(db)
+    assert started.wait(5)
+    assert ranker.features is old
+    assert ranker.rank(db, first) == [second]
+
+    # Обновление во время перечитывания попадает и в старую, и в новую матрицу
+    ranker.record_swipe(first)
+    assert old.activity[first] == 1
+    release.set()
+    for thread in threading.enumerate():
+        if thread.name == "ranker-reload":
+            thread.join(5)
+    assert ranker.features is not old
+    assert ranker.features.activity[first] == 1
+    assert ranker.features.present[second]
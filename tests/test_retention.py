@@ -0,0 +1,49 @@
+"""Очистка старых свайпов (app.retention) и её влияние на матчи и выдачу."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import crud, models, retention, schemas, sharding
+from app.seen import seen_index
+
+
+def age_likes(db, days):
+    for likes in sharding.all_sessions(db):
+        likes.execute(models.Like.__table__.update().values(created_at=datetime.utcnow() - timedelta(days=days)))
+    db.commit()
+
+
+@pytest.fixture(params=["single", "shards"])
+def layout(request):
+    # Одна база или два шарда свайпов
+    if request.param == "shards":
+        request.getfixturevalue("shards")
+    return request.param
+
+
+@pytest.mark.parametrize("path", ["like_user", "apply_swipes"])
+def test_archived_like_still_matches(layout, db, users, path):
+    first, second = users(2)
+    crud.like_user(db, first, second)
+    age_likes(db, retention.LIKE_RETENTION_DAYS + 1)
+    assert retention.compact(pause=0)["likes_archived"] == 1
+    assert crud.get_all_skipped_ids(db, first) == [second]
+
+    if path == "like_user":
+        _, match = crud.like_user(db, second, first)
+        match_id = match.id if match else None
+    else:
+        [result] = crud.apply_swipes(db, second, [schemas.SwipeAction(to_user_id=first, action="like")])
+        match_id = result["match"]
+    assert match_id is not None
+    assert crud.get_match(db, first, second).id == match_id
+
+
+def test_archived_like_stays_seen(layout, db, users):
+    first, second, third = users(3)
+    crud.like_user(db, first, second)
+    age_likes(db, retention.LIKE_RETENTION_DAYS + 1)
+    retention.compact(pause=0)
+    seen_index.invalidate()
+    assert list(seen_index.get(db, first)) == [second]
+    assert crud.get_next_profile(db, first).id == third
@@ -0,0 +1,34 @@
+"""Индекс просмотренных анкет (app.seen)."""
+from app import crud, metrics
+from app.seen import seen_index
+
+
+def test_seen_index_evicts_least_recent(db, users, monkeypatch):
+    monkeypatch.setattr(seen_index, "maxsize", 2)
+    first, second, third = users(3)
+    crud.like_user(db, first, second)
+    before = seen_index.stats()
+
+    assert seen_index.contains(db, first, second)
+    seen_index.get(db, second)
+    seen_index.get(db, first)
+    # Третий пользователь вытесняет давнее обращение — второго
+    seen_index.get(db, third)
+    stats = seen_index.stats()
+    assert stats["size"] == 2
+    assert stats["evictions"] - before["evictions"] == 1
+    assert stats["hits"] - before["hits"] == 1
+
+    # Вытесненный массив читается из базы заново
+    crud.dislike_user(db, second, third)
+    assert seen_index.contains(db, second, third)
+    assert seen_index.contains(db, first, second)
+    assert seen_index.stats()["misses"] - before["misses"] == 5
+
+
+def test_seen_index_in_metrics(db, users):
+    first, second = users(2)
+    seen_index.get(db, first)
+    text = metrics.render()
+    assert f"seen_index_size {seen_index.stats()['size']}" in text
+    assert "seen_index_evictions_total" in text
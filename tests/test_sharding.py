@@ -0,0 +1,76 @@
+"""Матчи при шардировании свайпов (app.sharding, app.crud)."""
+import threading
+
+import pytest
+
+from app import crud, database, models, schemas
+
+
+def like(db, from_user_id, to_user_id, path):
+    if path == "like_user":
+        like, match = crud.like_user(db, from_user_id, to_user_id)
+        return like.id, match.id if match else None
+    [result] = crud.apply_swipes(db, from_user_id, [schemas.SwipeAction(to_user_id=to_user_id, action="like")])
+    return result["like"], result["match"]
+
+
+@pytest.mark.parametrize("path", ["like_user", "apply_swipes"])
+def test_crossing_likes_create_match(shards, users, monkeypatch, path):
+    # Пользователи в разных шардах: каждый лайк пишется в свой файл
+    first, second = users(2)
+    assert shards.shard_for(first) != shards.shard_for(second)
+
+    first_checked, second_checked = threading.Event(), threading.Event()
+    reciprocal_likes = crud.reciprocal_likes
+
+    def interleaved(db, from_user_id, to_user_ids):
+        found = reciprocal_likes(db, from_user_id, to_user_ids)
+        if from_user_id == first:
+            # Первый лайк ещё не закоммичен, пока второй проверяет встречный
+            first_checked.set()
+            second_checked.wait(1)
+        else:
+            second_checked.set()
+        return found
+
+    monkeypatch.setattr(crud, "reciprocal_likes", interleaved)
+    results = {}
+
+    def run(from_user_id, to_user_id):
+        db = database.SessionLocal()
+        try:
+            results[from_user_id] = like(db, from_user_id, to_user_id, path)
+        finally:
+            db.close()
+
+    thread = threading.Thread(target=run, args=(first, second))
+    thread.start()
+    assert first_checked.wait(5)
+    run(second, first)
+    thread.join()
+
+    matches = [match for _, match in results.values() if match is not None]
+    assert matches, results
+    db = database.SessionLocal()
+    try:
+        assert crud.get_match(db, first, second).id == matches[0]
+        assert [user.id for user in crud.get_matches(db, first, 50, 0)] == [second]
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize("path", ["like_user", "apply_swipes"])
+def test_repeated_like_repairs_missing_match(shards, db, users, path):
+    first, second = users(2)
+    like(db, first, second, path)
+    # Встречный лайк без матча: так оставались разминувшиеся лайки до блокировки шардов
+    second_shard = crud.session_for(db, second)
+    second_shard.execute(crud.insert_swipe(second_shard, models.Like).values(
+        id=10**6, from_user_id=second, to_user_id=first
+    ))
+    db.commit()
+    assert crud.get_match(db, first, second) is None
+
+    _, match_id = like(db, first, second, path)
+    assert match_id is not None
+    assert crud.get_match(db, first, second).id == match_id
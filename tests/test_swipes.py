@@ -0,0 +1,65 @@
+"""Пакетные свайпы: crud.apply_swipes и POST /api/profiles/swipes."""
+from fastapi.testclient import TestClient
+
+from app import crud, models, schemas
+from app.main import app
+
+
+def swipes(*pairs):
+    return [schemas.SwipeAction(to_user_id=to_user_id, action=action) for to_user_id, action in pairs]
+
+
+def test_mixed_batch(db, users):
+    me, liked, disliked = users(3)
+    results = crud.apply_swipes(db, me, swipes((liked, "like"), (disliked, "dislike")))
+
+    like = db.query(models.Like).filter_by(from_user_id=me, to_user_id=liked).one()
+    assert results == [
+        {"to_user_id": liked, "like": like.id, "match": None},
+        {"to_user_id": disliked, "like": None, "match": None},
+    ]
+    assert db.query(models.Dislike).filter_by(from_user_id=me, to_user_id=disliked).count() == 1
+    assert sorted(crud.get_all_skipped_ids(db, me)) == [liked, disliked]
+
+
+def test_repeated_like_returns_existing_ids(db, users):
+    me, other = users(2)
+    crud.like_user(db, other, me)
+    [first] = crud.apply_swipes(db, me, swipes((other, "like")))
+    assert first["match"] is not None
+
+    [again] = crud.apply_swipes(db, me, swipes((other, "like")))
+    assert again == first
+    assert db.query(models.Like).filter_by(from_user_id=me).count() == 1
+    assert db.query(models.Match).count() == 1
+
+
+def test_duplicate_swipes_in_one_batch(db, users):
+    me, other = users(2)
+    results = crud.apply_swipes(db, me, swipes((other, "like"), (other, "like")))
+    assert results[0] == results[1]
+    assert db.query(models.Like).count() == 1
+
+
+def test_match_inside_batch(db, users):
+    me, fan, stranger = users(3)
+    crud.like_user(db, fan, me)
+    results = crud.apply_swipes(db, me, swipes((stranger, "like"), (fan, "like")))
+
+    match = crud.get_match(db, me, fan)
+    assert match is not None
+    assert [result["match"] for result in results] == [None, match.id]
+    assert crud.get_match(db, me, stranger) is None
+
+
+def test_batch_size_cap(engine, users):
+    me, other = users(2)
+    with TestClient(app) as client:
+        batch = {"swipes": [{"to_user_id": other, "action": "like"}] * (schemas.SWIPE_BATCH_MAX + 1)}
+        response = client.post("/api/profiles/swipes", params={"current_user_id": me}, json=batch)
+        assert response.status_code == 422
+
+        batch = {"swipes": [{"to_user_id": other, "action": "like"}] * schemas.SWIPE_BATCH_MAX}
+        response = client.post("/api/profiles/swipes", params={"current_user_id": me}, json=batch)
+        assert response.status_code == 200
+        assert len(response.json()["results"]) == schemas.SWIPE_BATCH_MAX
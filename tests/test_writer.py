@@ -0,0 +1,77 @@
+"""Групповой коммит свайпов (app.writer.SwipeWriter)."""
+import asyncio
+
+import pytest
+from sqlalchemy import event
+
+from app import crud, database, models, schemas
+from app.writer import SwipeWriter
+
+
+@pytest.fixture
+def commits(engine):
+    """Счётчик коммитов во всех движках основной базы; считайте после подготовки данных."""
+    count = [0]
+
+    def on_commit(connection):
+        count[0] += 1
+
+    engines = (database.engine, database.async_engine.sync_engine)
+    for target in engines:
+        event.listen(target, "commit", on_commit)
+    yield count
+    for target in engines:
+        event.remove(target, "commit", on_commit)
+
+
+def like(to_user_id):
+    return [schemas.SwipeAction(to_user_id=to_user_id, action="like")]
+
+
+async def submit_all(writer, jobs):
+    try:
+        return await asyncio.gather(*(writer.submit(from_user_id, swipes) for from_user_id, swipes in jobs),
+                                    return_exceptions=True)
+    finally:
+        await writer.stop()
+
+
+def test_results_in_order_one_commit_per_window(db, users, commits):
+    ids = users(5)
+    commits[0] = 0
+    target = ids[0]
+    jobs = [(from_user_id, like(target)) for from_user_id in ids[1:]]
+    results = asyncio.run(submit_all(SwipeWriter(window_ms=200), jobs))
+
+    assert commits[0] == 1
+    for (from_user_id, _), [result] in zip(jobs, results):
+        like_row = db.query(models.Like).filter_by(from_user_id=from_user_id, to_user_id=target).one()
+        assert result == {"to_user_id": target, "like": like_row.id, "match": None}
+
+
+def test_group_is_cut_at_max_rows(db, users, commits):
+    ids = users(5)
+    commits[0] = 0
+    jobs = [(from_user_id, like(ids[0])) for from_user_id in ids[1:]]
+    asyncio.run(submit_all(SwipeWriter(window_ms=200, max_rows=2), jobs))
+    assert commits[0] == 2
+    assert db.query(models.Like).count() == 4
+
+
+def test_failed_job_does_not_poison_group(db, users, monkeypatch):
+    ids = users(4)
+    broken = ids[2]
+    write_swipes = crud.write_swipes
+
+    def failing(db, from_user_id, swipes):
+        if from_user_id == broken:
+            raise RuntimeError("broken job")
+        return write_swipes(db, from_user_id, swipes)
+
+    monkeypatch.setattr(crud, "write_swipes", failing)
+    jobs = [(from_user_id, like(ids[0])) for from_user_id in ids[1:]]
+    results = asyncio.run(submit_all(SwipeWriter(window_ms=200), jobs))
+
+    assert isinstance(results[1], RuntimeError)
+    assert [result[0]["like"] is not None for i, result in enumerate(results) if i != 1] == [True, True]
+    assert sorted(row.from_user_id for row in db.query(models.Like)) == [ids[1], ids[3]]